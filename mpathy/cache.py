@@ -0,0 +1,175 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .fields import LTree
+
+
+def _path_hash(path):
+    # Paths can be longer than memcached allows for keys, and contain characters
+    # it doesn't allow either.
+    return hashlib.blake2b(path.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SubtreeCache:
+    """
+    A read-through cache of subtrees, keyed by the path of each subtree's root.
+    Entries are stored in one of django's caches, with an in-process LRU in front.
+
+    Entries are invalidated with version tokens, which are also stored in the
+    django cache so that every process sees them:
+     * the "subtree" version of a path changes whenever a write touches that path
+       or anything below it.
+     * the "node" version of a path changes whenever a write touches that path.
+    An entry for path P is valid while the subtree version of P and the node versions
+    of all P's ancestors are unchanged. So a write to path Q invalidates the entries
+    for Q's ancestors, Q itself and everything below Q, but not for anything else,
+    even elsewhere under the same root.
+
+    There's also a version for each table, which invalidates all of its entries.
+    """
+
+    def __init__(self, alias, maxsize):
+        self.alias = alias
+        self.maxsize = maxsize
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _version_keys(self, db, db_table, path):
+        prefix = "mpathy:%s:%s:" % (db, db_table)
+        keys = [prefix + "all", prefix + "s:" + _path_hash(path)]
+        ancestor = path.parent()
+        while ancestor is not None:
+            keys.append(prefix + "n:" + _path_hash(ancestor))
+            ancestor = ancestor.parent()
+        return keys
+
+    def _get_versions(self, version_keys):
+        cache = self.cache
+        versions = cache.get_many(version_keys)
+        missing = [key for key in version_keys if key not in versions]
+        if missing:
+            # Never set, or evicted. add() won't overwrite a token which another
+            # process has just set, so read them back afterwards.
+            for key in missing:
+                cache.add(key, uuid.uuid4().hex, timeout=None)
+            versions.update(cache.get_many(missing))
+        return tuple(versions.get(key) for key in version_keys)
+
+    def versions(self, db, db_table, path):
+        """
+        Returns the current version tokens for the subtree at `path`. They change
+        whenever a cached subtree for that path would be invalidated.
+        """
+        return self._get_versions(self._version_keys(db, db_table, LTree(path)))
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                self._local.move_to_end(key)
+            return entry
+
+    def _set_local(self, key, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def get(self, db, db_table, path, max_depth, fill):
+        """
+        Returns the cached subtree for the given path and max_depth, calling fill()
+        to build it if there's no valid entry.
+        """
+        path = LTree(path)
+        # Read the versions before filling, so that a write which happens while
+        # filling leaves the new entry invalid rather than stale.
+        versions = self.versions(db, db_table, path)
+
+        local_key = (db, db_table, path, max_depth)
+        entry = self._get_local(local_key)
+        if entry is None or entry[0] != versions:
+            key = "mpathy:%s:%s:t:%s:%s" % (db, db_table, _path_hash(path), max_depth)
+            entry = self.cache.get(key)
+            if entry is None or entry[0] != versions:
+                entry = (versions, fill())
+                self.cache.set(key, entry)
+            self._set_local(local_key, entry)
+        return entry[1]
+
+    def invalidate(self, db, db_table, paths):
+        """
+        Invalidates the entries affected by writes to the given paths.
+        """
+        prefix = "mpathy:%s:%s:" % (db, db_table)
+        keys = set()
+        for path in paths:
+            path = LTree(path)
+            keys.add(prefix + "n:" + _path_hash(path))
+            while path is not None:
+                keys.add(prefix + "s:" + _path_hash(path))
+                path = path.parent()
+        if keys:
+            token = uuid.uuid4().hex
+            self.cache.set_many({key: token for key in keys}, timeout=None)
+
+    def invalidate_all(self, db, db_table):
+        """
+        Invalidates all the entries for the given table.
+        """
+        self.cache.set("mpathy:%s:%s:all" % (db, db_table), uuid.uuid4().hex, timeout=None)
+
+
+_subtree_cache = None
+
+
+def get_subtree_cache():
+    """
+    Returns the SubtreeCache configured by the MPATHY_SUBTREE_CACHE setting (the
+    alias of one of the CACHES) and MPATHY_SUBTREE_CACHE_SIZE (the number of
+    entries in the in-process LRU, default 128), or None if it isn't configured.
+    """
+    global _subtree_cache
+    alias = getattr(settings, "MPATHY_SUBTREE_CACHE", None)
+    if alias is None:
+        return None
+    maxsize = getattr(settings, "MPATHY_SUBTREE_CACHE_SIZE", 128)
+    subtree_cache = _subtree_cache
+    if subtree_cache is None or (subtree_cache.alias, subtree_cache.maxsize) != (
+        alias,
+        maxsize,
+    ):
+        subtree_cache = _subtree_cache = SubtreeCache(alias, maxsize)
+    return subtree_cache
+
+
+def invalidate_subtrees(model, paths, using):
+    """
+    Invalidates cached subtrees affected by writes to the given paths, once the
+    current transaction commits. Paths are the roots of changed subtrees: for a move,
+    pass the old and new paths of the moved node.
+
+    mpathy's own methods call this. Call it yourself after changing nodes with
+    QuerySet.update(), QuerySet.delete() or raw SQL, or run a
+    mpathy.notify.SubtreeChangeListener to catch every change in the database.
+    """
+    subtree_cache = get_subtree_cache()
+    if subtree_cache is None:
+        return
+    paths = list(paths)
+    if not paths:
+        return
+    db_table = model._meta.db_table
+    transaction.on_commit(
+        lambda: subtree_cache.invalidate(using, db_table, paths), using=using
+    )
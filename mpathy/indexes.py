@@ -0,0 +1,80 @@
+import copy
+
+from django.contrib.postgres.indexes import GistIndex, HashIndex
+from django.db import models
+
+
+class LTreeGistIndex(GistIndex):
+    """
+    A GiST index on ltree columns, which can set the signature length of the
+    gist_ltree_ops operator class (Postgres 13+).
+
+    Longer signatures make the index bigger, but reduce false positives (and so
+    rechecks of heap rows) for <@, @> and ~ queries on large trees.
+    """
+
+    def __init__(self, *args, siglen=None, **kwargs):
+        self.siglen = siglen
+        super(LTreeGistIndex, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        path, args, kwargs = super(LTreeGistIndex, self).deconstruct()
+        if self.siglen is not None:
+            kwargs["siglen"] = self.siglen
+        return path, args, kwargs
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        index = self
+        if self.siglen is not None:
+            # django only allows opclasses on named indexes, but by the time the SQL
+            # is generated the index will always have a name.
+            index = copy.copy(self)
+            index.opclasses = ["gist_ltree_ops(siglen=%d)" % self.siglen] * len(
+                self.fields
+            )
+        return super(LTreeGistIndex, index).create_sql(
+            model, schema_editor, using=using, **kwargs
+        )
+
+
+INDEX_TYPES = ("gist", "btree", "hash")
+
+
+def _index_for(field_name, index_type, siglen):
+    if index_type == "gist":
+        if siglen is None:
+            return GistIndex(fields=[field_name])
+        return LTreeGistIndex(fields=[field_name], siglen=siglen)
+    if index_type == "btree":
+        return models.Index(fields=[field_name])
+    if index_type == "hash":
+        return HashIndex(fields=[field_name])
+    raise ValueError(
+        "Unknown index type %r for %r. Expected one of %s, or None"
+        % (index_type, field_name, ", ".join(INDEX_TYPES))
+    )
+
+
+def mpath_indexes(ltree="gist", parent="gist", siglen=None):
+    """
+    Returns a list of indexes for an MPathNode model's Meta.indexes.
+
+    `ltree` and `parent` choose the index type for each column: 'gist', 'btree',
+    'hash' or None (no index). `siglen` sets the signature length of GiST indexes.
+
+    The default matches MPathNode's own indexes. Since the unique constraint on ltree
+    already creates a btree index, 'gist' (or None) is the useful choice for ltree.
+    A btree or hash index on parent is smaller and faster for the equality lookups
+    used by get_siblings() and the parent foreign key, but can't be used for the
+    ltree operators.
+
+    e.g.
+        class Category(MPathNode):
+            class Meta:
+                indexes = mpath_indexes(parent="hash", siglen=256)
+    """
+    indexes = []
+    for field_name, index_type in (("ltree", ltree), ("parent", parent)):
+        if index_type is not None:
+            indexes.append(_index_for(field_name, index_type, siglen))
+    return indexes
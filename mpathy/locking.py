@@ -0,0 +1,184 @@
+import hashlib
+from contextlib import contextmanager
+
+from django.db import OperationalError, connections, router, transaction
+from django.db.transaction import TransactionManagementError
+
+from .fields import LTree
+
+# SQLSTATE lock_not_available, raised when lock_timeout expires.
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+class SubtreeLockTimeout(OperationalError):
+    """
+    Raised when subtree locks can't be acquired within the requested timeout.
+    The transaction is aborted, as with any other database error.
+    """
+
+
+def subtree_lock_key(db_table, path):
+    """
+    Returns the 64-bit advisory lock key for the subtree at `path` in the given table.
+
+    Keys are hashes, so two unrelated paths may occasionally share a key. That only
+    makes one of them wait unnecessarily.
+    """
+    value = ("%s:%s" % (db_table, path)).encode("utf-8")
+    digest = hashlib.blake2b(value, digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def subtree_lock_keys(db_table, paths, anchors=()):
+    """
+    Returns the (key, exclusive) advisory locks needed to lock the subtrees at `paths`,
+    sorted by key.
+
+    Each subtree's own path is locked exclusively, and all its ancestors are locked
+    in shared mode. So two subtree locks conflict if and only if one subtree contains
+    the other, and locks on disjoint subtrees never wait for each other.
+
+    `anchors` are paths which mustn't move while the locks are held (e.g. the new
+    parent of a moved subtree). They and their ancestors are only locked in shared
+    mode, which blocks anyone locking a subtree containing them.
+    """
+    modes = {}
+
+    def add(path, exclusive):
+        while path is not None:
+            key = subtree_lock_key(db_table, path)
+            modes[key] = modes.get(key, False) or exclusive
+            # Ancestors are always shared
+            exclusive = False
+            path = path.parent()
+
+    for path in paths:
+        add(LTree(path), True)
+    for path in anchors:
+        add(LTree(path), False)
+    return sorted(modes.items())
+
+
+def acquire_subtree_locks(model, paths, anchors=(), timeout=None, using=None):
+    """
+    Takes the advisory locks from subtree_lock_keys() in the current transaction.
+    They are released when the transaction ends.
+
+    Locks are taken in key order, so transactions which take all their subtree locks
+    in a single call can't deadlock with each other.
+
+    If `timeout` (in seconds) is given and a lock can't be acquired in that time,
+    raises SubtreeLockTimeout.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    if not connection.in_atomic_block:
+        raise TransactionManagementError(
+            "Subtree locks can only be taken inside a transaction."
+        )
+
+    keys = subtree_lock_keys(model._meta.db_table, paths, anchors)
+    with connection.cursor() as cursor:
+        if timeout is not None:
+            cursor.execute("SELECT current_setting('lock_timeout')")
+            (old_timeout,) = cursor.fetchone()
+            # A lock_timeout of 0 means no timeout, so never go below 1ms
+            cursor.execute(
+                "SELECT set_config('lock_timeout', %s, true)",
+                ["%dms" % max(1, int(timeout * 1000))],
+            )
+        try:
+            for key, exclusive in keys:
+                if exclusive:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s)", [key])
+                else:
+                    cursor.execute("SELECT pg_advisory_xact_lock_shared(%s)", [key])
+        except OperationalError as e:
+            if getattr(e.__cause__, "pgcode", None) == LOCK_NOT_AVAILABLE:
+                raise SubtreeLockTimeout(
+                    "Timed out waiting for subtree locks on %s"
+                    % ", ".join(sorted(paths))
+                ) from e
+            raise
+        if timeout is not None:
+            cursor.execute("SELECT set_config('lock_timeout', %s, true)", [old_timeout])
+
+
+class _PathsMoved(Exception):
+    pass
+
+
+def _refresh_paths(model, nodes, using):
+    """
+    Updates the ltree (and parent) of the given instances from the database.
+    Returns True if any of them had moved.
+    """
+    current = dict(
+        model._base_manager.using(using)
+        .filter(pk__in=[node.pk for node in nodes])
+        .values_list("pk", "ltree")
+    )
+    changed = False
+    for node in nodes:
+        if node.pk not in current:
+            raise model.DoesNotExist(
+                "%s matching %r no longer exists." % (model._meta.object_name, node.ltree)
+            )
+        ltree = current[node.pk]
+        if ltree != node.ltree:
+            node.ltree = ltree
+            node.parent_id = ltree.parent()
+            changed = True
+    return changed
+
+
+@contextmanager
+def subtree_locks(model, nodes, anchors=(), timeout=None, lock_rows=False, using=None):
+    """
+    A context manager which runs its block in a transaction holding the subtree locks
+    for the given nodes (see subtree_lock_keys()).
+
+    Once the locks are held, the paths of `nodes` and `anchors` are refreshed from
+    the database, since another transaction may have moved them while this one was
+    waiting. If they have moved, the locks are released and all the locks for their
+    new paths are taken again.
+
+    With `lock_rows=True`, every row in the subtrees is also locked with
+    SELECT ... FOR UPDATE, in ltree order. That blocks writers which don't use subtree
+    locks, e.g. plain save() calls, but is much more expensive for big subtrees.
+
+    The locks are held until the outermost transaction ends, not just to the end of
+    the block.
+    """
+    using = using or router.db_for_write(model)
+    nodes = list(nodes)
+    anchors = [anchor for anchor in anchors if anchor is not None]
+    with transaction.atomic(using=using):
+        while True:
+            try:
+                # In a savepoint, so that if anything has moved, rolling back releases
+                # the locks and the new set is taken in a single sorted pass. Taking
+                # just the extra locks would be out of order, and could deadlock.
+                with transaction.atomic(using=using):
+                    acquire_subtree_locks(
+                        model,
+                        [node.ltree for node in nodes],
+                        anchors=[anchor.ltree for anchor in anchors],
+                        timeout=timeout,
+                        using=using,
+                    )
+                    if _refresh_paths(model, nodes + anchors, using):
+                        raise _PathsMoved
+            except _PathsMoved:
+                continue
+            break
+
+        if lock_rows and nodes:
+            list(
+                model._base_manager.using(using)
+                .filter(ltree__descendant_or_equal_any=[node.ltree for node in nodes])
+                .order_by("ltree")
+                .select_for_update()
+                .values_list("pk", flat=True)
+            )
+        yield
@@ -0,0 +1,52 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from mpathy.models import MPathNode
+
+FORMATS = ("csv", "jsonl")
+
+# COPY options which pass each line through untouched: JSON text never contains raw
+# newlines or these control characters, so nothing is ever quoted.
+JSONL_COPY_OPTIONS = "FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02'"
+
+
+class TreeCopyCommand(BaseCommand):
+    """
+    Shared arguments for mpathy_export and mpathy_import.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "model", help="The MPathNode model, as app_label.ModelName"
+        )
+        parser.add_argument(
+            "--format", choices=FORMATS, default="csv", help="Default: csv"
+        )
+        parser.add_argument(
+            "--database", default="default", help="The database to use. Default: default"
+        )
+
+    def get_model(self, label):
+        try:
+            model = apps.get_model(label)
+        except (LookupError, ValueError) as e:
+            raise CommandError(str(e))
+        if not issubclass(model, MPathNode):
+            raise CommandError("%s isn't an MPathNode model" % label)
+        return model
+
+    def get_columns(self, model, names):
+        """
+        Checks the given column names against the model's concrete fields.
+        """
+        columns = {f.column for f in model._meta.concrete_fields}
+        unknown = [name for name in names if name not in columns]
+        if unknown:
+            raise CommandError(
+                "Unknown columns for %s: %s"
+                % (model._meta.label, ", ".join(unknown))
+            )
+        ltree_column = model._meta.get_field("ltree").column
+        if ltree_column not in names:
+            raise CommandError("The %s column is required" % ltree_column)
+        return list(names)
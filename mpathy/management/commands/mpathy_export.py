@@ -0,0 +1,63 @@
+from django.db import connections
+
+from ._base import JSONL_COPY_OPTIONS, TreeCopyCommand
+
+
+class Command(TreeCopyCommand):
+    help = (
+        "Exports the nodes of an MPathNode model as CSV (with a header row) or JSON "
+        "lines, in ltree order, streamed with COPY."
+    )
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument(
+            "-o", "--output", help="The file to write to. Default: standard output"
+        )
+        parser.add_argument(
+            "--columns",
+            nargs="+",
+            help="The columns to export. Default: all except the primary key",
+        )
+        parser.add_argument("--subtree", help="Only export the subtree at this path")
+
+    def handle(self, *args, **options):
+        model = self.get_model(options["model"])
+        meta = model._meta
+        columns = self.get_columns(
+            model,
+            options["columns"]
+            or [f.column for f in meta.concrete_fields if not f.primary_key],
+        )
+
+        connection = connections[options["database"]]
+        qn = connection.ops.quote_name
+        ltree_col = qn(meta.get_field("ltree").column)
+        query = "SELECT %s FROM %s" % (
+            ", ".join(qn(column) for column in columns),
+            qn(meta.db_table),
+        )
+
+        with connection.cursor() as cursor:
+            if options["subtree"]:
+                query = cursor.mogrify(
+                    query + " WHERE %s <@ %%s::ltree" % ltree_col, [options["subtree"]]
+                ).decode()
+            # Parents come before their children, so the output can be imported in order
+            query += " ORDER BY %s" % ltree_col
+
+            if options["format"] == "csv":
+                sql = "COPY (%s) TO STDOUT WITH (FORMAT csv, HEADER)" % query
+            else:
+                sql = "COPY (SELECT row_to_json(r)::text FROM (%s) r) TO STDOUT WITH (%s)" % (
+                    query,
+                    JSONL_COPY_OPTIONS,
+                )
+
+            if options["output"]:
+                with open(options["output"], "w", encoding="utf-8", newline="") as f:
+                    cursor.copy_expert(sql, f)
+            else:
+                # COPY writes whole lines, so don't let the wrapper add newlines
+                self.stdout.ending = ""
+                cursor.copy_expert(sql, self.stdout)
@@ -0,0 +1,228 @@
+import csv
+import sys
+
+from django.core.management.base import CommandError
+from django.db import connections, transaction
+
+from mpathy.cache import get_subtree_cache
+from mpathy.models import has_count_fields
+from mpathy.operations import LTREE_CHECK_CONDITIONS
+
+from ._base import JSONL_COPY_OPTIONS, TreeCopyCommand
+
+STAGING_TABLE = "mpathy_import"
+STAGING_LINES_TABLE = "mpathy_import_lines"
+
+# The most problems to report from each check
+MAX_PROBLEMS = 20
+
+VALIDATION_QUERY = """
+    (
+        SELECT 'parent_id is inconsistent with the path', ltree::text FROM %(staging)s
+        WHERE ltree IS NULL OR NOT (%(condition)s)
+        LIMIT %(limit)s
+    ) UNION ALL (
+        SELECT 'label is inconsistent with the path', ltree::text FROM %(staging)s
+        WHERE label IS DISTINCT FROM subpath(ltree, -1)::text
+        LIMIT %(limit)s
+    ) UNION ALL (
+        SELECT 'duplicate path', ltree::text FROM %(staging)s
+        GROUP BY ltree HAVING count(*) > 1
+        LIMIT %(limit)s
+    ) UNION ALL (
+        SELECT 'parent is missing', ltree::text FROM %(staging)s s
+        WHERE s.parent_id IS NOT NULL
+        AND NOT EXISTS (SELECT 1 FROM %(staging)s p WHERE p.ltree = s.parent_id)
+        %(merge_condition)s
+        LIMIT %(limit)s
+    )
+"""
+
+
+class Command(TreeCopyCommand):
+    help = (
+        "Imports nodes of an MPathNode model from CSV (with a header row) or JSON "
+        "lines, as written by mpathy_export. The file is loaded into a staging table "
+        "with COPY, and every path is validated before any rows are written. "
+        "--mode=replace deletes the existing nodes first; --mode=merge inserts new "
+        "nodes and updates existing ones with the same path."
+    )
+
+    def add_arguments(self, parser):
+        super(Command, self).add_arguments(parser)
+        parser.add_argument("file", help="The file to read, or - for standard input")
+        parser.add_argument(
+            "--mode", choices=("merge", "replace"), default="merge", help="Default: merge"
+        )
+
+    def handle(self, *args, **options):
+        model = self.get_model(options["model"])
+        self.database = options["database"]
+        connection = connections[self.database]
+
+        if options["file"] == "-":
+            self.import_file(model, connection, sys.stdin, options)
+        else:
+            with open(options["file"], encoding="utf-8", newline="") as f:
+                self.import_file(model, connection, f, options)
+
+    def import_file(self, model, connection, f, options):
+        meta = model._meta
+        qn = connection.ops.quote_name
+        table = qn(meta.db_table)
+        staging = qn(STAGING_TABLE)
+        replace = options["mode"] == "replace"
+
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            # Without NOT NULL constraints, so that labels and parents can be filled in
+            cursor.execute(
+                "CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT * FROM %s WITH NO DATA"
+                % (staging, table)
+            )
+            if options["format"] == "csv":
+                columns = self.copy_csv(model, cursor, f, staging)
+            else:
+                columns = self.copy_jsonl(model, cursor, f, staging)
+
+            # Labels and parents can be left out, since they're implied by the paths
+            if "label" not in columns:
+                cursor.execute(
+                    "UPDATE %s SET label = subpath(ltree, -1)::text" % staging
+                )
+                columns.append("label")
+            if "parent_id" not in columns:
+                cursor.execute(
+                    "UPDATE %s SET parent_id = subpath(ltree, 0, -1) WHERE nlevel(ltree) > 1"
+                    % staging
+                )
+                columns.append("parent_id")
+            cursor.execute("ANALYZE %s" % staging)
+
+            self.validate(cursor, table, staging, replace)
+
+            # The primary keys and database-maintained counts are never imported.
+            # New nodes start with zero counts, which the INSERT trigger recalculates.
+            skip = {meta.pk.column}
+            count_columns = []
+            if has_count_fields(model):
+                count_columns = [
+                    meta.get_field("child_count").column,
+                    meta.get_field("descendant_count").column,
+                ]
+                skip.update(count_columns)
+            columns = [column for column in columns if column not in skip]
+
+            # Django defaults for columns which aren't in the file. Callable defaults
+            # are only called once, so all the imported nodes get the same value.
+            default_fields = [
+                field
+                for field in meta.concrete_fields
+                if field.column not in columns
+                and field.column not in skip
+                and field.has_default()
+            ]
+            insert_columns = columns + [field.column for field in default_fields]
+            params = [
+                field.get_db_prep_save(field.get_default(), connection)
+                for field in default_fields
+            ]
+            sql = "INSERT INTO %s (%s) SELECT %s FROM %s ORDER BY ltree" % (
+                table,
+                ", ".join(qn(column) for column in insert_columns + count_columns),
+                ", ".join(
+                    [qn(column) for column in columns]
+                    + ["%s"] * len(params)
+                    + ["0"] * len(count_columns)
+                ),
+                staging,
+            )
+
+            deleted = 0
+            if replace:
+                cursor.execute("DELETE FROM %s" % table)
+                deleted = cursor.rowcount
+            else:
+                # Only update the columns in the file. Defaults for the others are
+                # only for new nodes.
+                sql += " ON CONFLICT (ltree) DO UPDATE SET %s" % ", ".join(
+                    "%s = EXCLUDED.%s" % (qn(column), qn(column))
+                    for column in columns
+                    if column != "ltree"
+                )
+            cursor.execute(sql, params)
+            imported = cursor.rowcount
+
+            # Drop it now, in case this is part of a larger transaction
+            cursor.execute("DROP TABLE %s" % staging)
+
+            subtree_cache = get_subtree_cache()
+            if subtree_cache is not None:
+                transaction.on_commit(
+                    lambda: subtree_cache.invalidate_all(connection.alias, meta.db_table),
+                    using=connection.alias,
+                )
+
+        if replace:
+            self.stdout.write("Deleted %d nodes, imported %d nodes" % (deleted, imported))
+        else:
+            self.stdout.write("Imported %d nodes" % imported)
+
+    def copy_csv(self, model, cursor, f, staging):
+        header = f.readline()
+        if not header:
+            raise CommandError("The file is empty")
+        columns = self.get_columns(model, next(csv.reader([header])))
+        # The rest of the file is streamed straight into the staging table
+        qn = connections[self.database].ops.quote_name
+        cursor.copy_expert(
+            "COPY %s (%s) FROM STDIN WITH (FORMAT csv)"
+            % (staging, ", ".join(qn(column) for column in columns)),
+            f,
+        )
+        return columns
+
+    def copy_jsonl(self, model, cursor, f, staging):
+        lines = connections[self.database].ops.quote_name(STAGING_LINES_TABLE)
+        cursor.execute(
+            "CREATE TEMPORARY TABLE %s (doc json) ON COMMIT DROP" % lines
+        )
+        cursor.copy_expert(
+            "COPY %s FROM STDIN WITH (%s)" % (lines, JSONL_COPY_OPTIONS), f
+        )
+        cursor.execute(
+            "SELECT DISTINCT json_object_keys(doc) FROM %s ORDER BY 1" % lines
+        )
+        columns = self.get_columns(model, [row[0] for row in cursor.fetchall()])
+        cursor.execute(
+            "INSERT INTO %s SELECT r.* FROM %s, json_populate_record(NULL::%s, doc) r"
+            % (staging, lines, staging)
+        )
+        cursor.execute("DROP TABLE %s" % lines)
+        return columns
+
+    def validate(self, cursor, table, staging, replace):
+        """
+        Checks all the staged rows against the same rules as the ltree check
+        constraint, in one query.
+        """
+        if replace:
+            merge_condition = ""
+        else:
+            merge_condition = (
+                "AND NOT EXISTS (SELECT 1 FROM %s t WHERE t.ltree = s.parent_id)" % table
+            )
+        cursor.execute(
+            VALIDATION_QUERY
+            % {
+                "staging": staging,
+                "condition": LTREE_CHECK_CONDITIONS["functions"],
+                "merge_condition": merge_condition,
+                "limit": MAX_PROBLEMS,
+            }
+        )
+        problems = cursor.fetchall()
+        if problems:
+            raise CommandError(
+                "Invalid nodes, nothing was imported:\n%s"
+                % "\n".join("%s: %s" % (path, problem) for problem, path in problems)
+            )
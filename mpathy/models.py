@@ -1,15 +1,355 @@
-from django.contrib.postgres.indexes import GistIndex
-from django.db import models
+from collections import defaultdict
+from collections.abc import Mapping
+from itertools import chain
+
+from asgiref.sync import sync_to_async
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ, ISOLATION_LEVEL_SERIALIZABLE
+
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import connections, models, router, transaction
+from django.db.models import signals
+from django.db.models.deletion import (
+    Collector,
+    ProtectedError,
+    RestrictedError,
+    get_candidate_relations_to_delete,
+)
 from django.db.models.expressions import CombinedExpression, RawSQL
+from django.db.models.query import ModelIterable
 
-from .fields import LTree, LTreeField, Subpath
+from .cache import get_subtree_cache, invalidate_subtrees
+from .fields import Level, LTree, LTreeField, Subpath
+from .indexes import mpath_indexes
+from .locking import subtree_locks
+from .pagination import KeysetPaginator
+from .snapshot import TreeSnapshot
 
 
 class BadMove(ValueError):
     pass
 
 
+def has_count_fields(model):
+    """
+    Returns True if the model has the database-maintained child_count and
+    descendant_count fields from CountedMPathNode.
+    """
+    try:
+        model._meta.get_field("child_count")
+        model._meta.get_field("descendant_count")
+    except FieldDoesNotExist:
+        return False
+    return True
+
+
+def prefetch_descendants(nodes, max_depth=None):
+    """
+    Fetches the descendants of all the given nodes in a single query, and caches them
+    so that get_children() doesn't need to query the database.
+
+    If max_depth is given, only descendants down to that many levels below each node
+    are fetched. Nodes on the lowest fetched level don't have their children cached.
+    """
+    if not nodes:
+        return
+    model = type(nodes[0])
+    nodes_by_path = {node.ltree: node for node in nodes}
+    given_paths = set(nodes_by_path)
+    qs = model._default_manager.using(nodes[0]._state.db).filter(
+        ltree__lquery_any=[path.descendants_lquery(max_depth) for path in nodes_by_path]
+    )
+
+    for node in nodes:
+        node._cached_children = []
+
+    descendants = []
+    for descendant in qs:
+        # Prefer the instances we were given, if they're descendants of each other
+        descendant = nodes_by_path.setdefault(descendant.ltree, descendant)
+        descendants.append(descendant)
+        if descendant.ltree in given_paths:
+            continue
+
+        if max_depth is not None:
+            # Only cache children for this node if it's less than max_depth levels
+            # below one of the given nodes, otherwise they weren't fetched.
+            path = descendant.ltree.parent()
+            depth = 1
+            while path not in given_paths and depth < max_depth:
+                path = path.parent()
+                depth += 1
+            if depth >= max_depth:
+                continue
+        descendant._cached_children = []
+
+    for descendant in descendants:
+        nodes_by_path[descendant.ltree.parent()]._cached_children.append(descendant)
+
+
+def prefetch_ancestors(nodes):
+    """
+    Fetches the ancestors of all the given nodes in a single query, and caches them
+    so that get_ancestors() doesn't need to query the database.
+
+    Nodes which share ancestors share the same ancestor instances.
+    """
+    if not nodes:
+        return
+    model = type(nodes[0])
+    ancestor_paths = set()
+    for node in nodes:
+        path = node.ltree.parent()
+        while path is not None and path not in ancestor_paths:
+            ancestor_paths.add(path)
+            path = path.parent()
+
+    ancestors_by_path = {}
+    if ancestor_paths:
+        qs = model._default_manager.using(nodes[0]._state.db).filter(
+            ltree__in=ancestor_paths
+        )
+        ancestors_by_path = {ancestor.ltree: ancestor for ancestor in qs}
+
+    for node in nodes:
+        ancestors = []
+        path = node.ltree.parent()
+        while path is not None:
+            if path in ancestors_by_path:
+                ancestors.append(ancestors_by_path[path])
+            path = path.parent()
+        ancestors.reverse()
+        node._cached_ancestors = ancestors
+
+
 class MPathQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super(MPathQuerySet, self).__init__(*args, **kwargs)
+        # Maps prefetch functions (e.g. prefetch_descendants) to their kwargs
+        self._tree_prefetches = {}
+        self._tree_prefetches_done = False
+
+    def _clone(self):
+        clone = super(MPathQuerySet, self)._clone()
+        clone._tree_prefetches = self._tree_prefetches.copy()
+        return clone
+
+    def _fetch_all(self):
+        super(MPathQuerySet, self)._fetch_all()
+        if (
+            self._tree_prefetches
+            and not self._tree_prefetches_done
+            and self._iterable_class is ModelIterable
+        ):
+            for prefetch, kwargs in self._tree_prefetches.items():
+                prefetch(self._result_cache, **kwargs)
+            self._tree_prefetches_done = True
+
+    def _with_tree_prefetch(self, prefetch, **kwargs):
+        clone = self._chain()
+        clone._tree_prefetches[prefetch] = kwargs
+        return clone
+
+    def prefetch_children(self):
+        """
+        Returns a new queryset which, when evaluated, also fetches the children of
+        every node in one extra query, so get_children() doesn't query the database.
+        """
+        return self.prefetch_descendants(max_depth=1)
+
+    def prefetch_descendants(self, max_depth=None):
+        """
+        Returns a new queryset which, when evaluated, also fetches the descendants of
+        every node (down to max_depth levels below it) in one extra query.
+        The children of each node are cached, so get_children() doesn't query the
+        database.
+        """
+        return self._with_tree_prefetch(prefetch_descendants, max_depth=max_depth)
+
+    def prefetch_ancestors(self):
+        """
+        Returns a new queryset which, when evaluated, also fetches the ancestors of
+        every node in one extra query, so get_ancestors() doesn't query the database.
+        """
+        return self._with_tree_prefetch(prefetch_ancestors)
+
+    def _count_subquery(self, **filters):
+        """
+        Returns a correlated subquery expression counting the nodes which match the
+        given filters (which should refer to the outer query using OuterRef).
+        """
+        qs = (
+            self.model._default_manager.filter(**filters)
+            .order_by()
+            .annotate(count=models.Func(models.F("pk"), function="COUNT"))
+            .values("count")
+        )
+        return models.Subquery(qs, output_field=models.IntegerField())
+
+    def with_child_count(self):
+        """
+        Annotates each node with `child_count`, the number of children it has.
+
+        For CountedMPathNode models, this is already a field, so this does nothing.
+        """
+        if has_count_fields(self.model):
+            return self._chain()
+        return self.annotate(
+            child_count=self._count_subquery(parent=models.OuterRef("ltree"))
+        )
+
+    def with_descendant_count(self):
+        """
+        Annotates each node with `descendant_count`, the number of descendants it has.
+
+        For CountedMPathNode models, this is already a field, so this does nothing.
+        """
+        if has_count_fields(self.model):
+            return self._chain()
+        return self.annotate(
+            descendant_count=models.ExpressionWrapper(
+                self._count_subquery(
+                    ltree__descendant_or_equal=models.OuterRef("ltree")
+                )
+                - 1,
+                output_field=models.IntegerField(),
+            )
+        )
+
+    def with_is_leaf(self):
+        """
+        Annotates each node with `is_leaf`, which is True if the node has no children.
+        """
+        if has_count_fields(self.model):
+            return self.annotate(
+                is_leaf=models.ExpressionWrapper(
+                    models.Q(child_count=0), output_field=models.BooleanField()
+                )
+            )
+        children = self.model._default_manager.filter(parent=models.OuterRef("ltree"))
+        return self.annotate(is_leaf=~models.Exists(children))
+
+    def delete_subtrees(self, send_signals=True, collect_related=True):
+        """
+        Deletes the nodes in this queryset and all their descendants.
+
+        Unlike delete(), this doesn't walk the tree one level at a time: all the nodes
+        are deleted with a single `DELETE ... WHERE ltree <@ ANY(...)`.
+
+        If collect_related is True, other models' foreign keys to the deleted nodes are
+        handled according to their on_delete, as delete() would. Set it to False if
+        you know there aren't any.
+
+        If send_signals is True (and there are any receivers), pre_delete and
+        post_delete are sent for every deleted node. That means loading them all,
+        so pass send_signals=False to skip it.
+
+        Returns the same (count, {model_label: count}) tuple as delete().
+        """
+        model = self.model
+        # Like delete(), read the paths from the database which will be written to
+        del_query = self._chain()
+        del_query._for_write = True
+        db = del_query.db
+        paths = list(del_query.order_by().values_list("ltree", flat=True))
+        if not paths:
+            return 0, {}
+        subtree = model._base_manager.using(db).filter(
+            ltree__descendant_or_equal_any=paths
+        )
+        send_signals = send_signals and (
+            signals.pre_delete.has_listeners(model)
+            or signals.post_delete.has_listeners(model)
+        )
+
+        # Like delete(), collect before starting the transaction, so that a
+        # ProtectedError doesn't break an outer one
+        collector = None
+        if collect_related:
+            collector = Collector(using=db)
+            self._collect_related(collector, subtree)
+
+        with transaction.atomic(using=db, savepoint=False):
+            instances = []
+            if send_signals:
+                for instance in subtree.iterator():
+                    signals.pre_delete.send(sender=model, instance=instance, using=db)
+                    instances.append(instance)
+
+            deleted, counts = 0, {}
+            if collector is not None:
+                deleted, counts = collector.delete()
+
+            count = subtree._raw_delete(db)
+            invalidate_subtrees(model, paths, db)
+
+        if send_signals:
+            for instance in instances:
+                signals.post_delete.send(sender=model, instance=instance, using=db)
+                setattr(instance, model._meta.pk.attname, None)
+
+        counts = {label: n for label, n in counts.items() if n}
+        if count:
+            counts[model._meta.label] = counts.get(model._meta.label, 0) + count
+        return deleted + count, counts
+
+    def _collect_related(self, collector, subtree):
+        """
+        Runs the on_delete handlers of other foreign keys to the nodes in subtree,
+        raising ProtectedError or RestrictedError as Collector.collect() would.
+
+        The subtree itself isn't collected, since it's deleted in one statement, and
+        the parent foreign key is skipped, since the children are in the subtree too.
+        """
+        model = self.model
+        parent_field = model._meta.get_field("parent")
+        protected_objects = defaultdict(list)
+        for related in get_candidate_relations_to_delete(model._meta):
+            field = related.field
+            if field is parent_field or field.remote_field.on_delete == models.DO_NOTHING:
+                continue
+            related_objs = collector.related_objects(related.related_model, [field], subtree)
+            if related_objs:
+                try:
+                    field.remote_field.on_delete(collector, field, related_objs, collector.using)
+                except ProtectedError as error:
+                    key = "'%s.%s'" % (field.model.__name__, field.name)
+                    protected_objects[key] += error.protected_objects
+        if protected_objects:
+            raise ProtectedError(
+                "Cannot delete some instances of model %r because they are "
+                "referenced through protected foreign keys: %s."
+                % (model.__name__, ", ".join(protected_objects)),
+                set(chain.from_iterable(protected_objects.values())),
+            )
+
+        # Restricted objects can still be deleted if they're being deleted anyway,
+        # either in the subtree or by a cascade
+        collector.clear_restricted_objects_from_queryset(model, subtree)
+        for related_model, instances in collector.data.items():
+            collector.clear_restricted_objects_from_set(related_model, instances)
+        for qs in collector.fast_deletes:
+            collector.clear_restricted_objects_from_queryset(qs.model, qs)
+        restricted_objects = defaultdict(list)
+        for related_model, fields in collector.restricted_objects.items():
+            for field, objs in fields.items():
+                if objs:
+                    key = "'%s.%s'" % (related_model.__name__, field.name)
+                    restricted_objects[key] += objs
+        if restricted_objects:
+            raise RestrictedError(
+                "Cannot delete some instances of model %r because they are "
+                "referenced through restricted foreign keys: %s."
+                % (model.__name__, ", ".join(restricted_objects)),
+                set(chain.from_iterable(restricted_objects.values())),
+            )
+
+    def keyset_paginator(self, per_page, breadth_first=False):
+        """
+        Returns a KeysetPaginator for this queryset, which pages through the nodes in
+        depth-first (or breadth-first) order without using OFFSET.
+        """
+        return KeysetPaginator(self, per_page, breadth_first=breadth_first)
+
     def get_cached_trees(self):
         """
         Evaluates this queryset and returns a list of top-level nodes.
@@ -33,9 +373,327 @@ class MPathQuerySet(models.QuerySet):
 
         return top_level_nodes
 
+    def iter_cached_trees(self, chunk_size=2000):
+        """
+        A streaming version of get_cached_trees(), for very large querysets.
+
+        Rows are read in ltree order using a server-side cursor, and each top-level
+        node is yielded (with its children cached, as for get_cached_trees()) as soon
+        as its whole subtree has been read. Only the current branch is held in memory,
+        rather than the whole result.
+
+        NOTE: This replaces any ordering on the queryset with ltree ordering.
+        Nodes whose parent isn't in the queryset are yielded as top-level nodes,
+        after any of their own descendants in the queryset.
+        """
+        # The current branch, from the outermost node inwards, as
+        # (node, is_top_level) pairs.
+        stack = []
+        for node in self.order_by("ltree").iterator(chunk_size=chunk_size):
+            node._cached_children = []
+            while stack and not stack[-1][0].ltree.is_ancestor_of(node.ltree):
+                finished, is_top_level = stack.pop()
+                if is_top_level:
+                    yield finished
+
+            if stack and stack[-1][0].ltree == node.ltree.parent():
+                stack[-1][0]._cached_children.append(node)
+                stack.append((node, False))
+            else:
+                stack.append((node, True))
+
+        while stack:
+            finished, is_top_level = stack.pop()
+            if is_top_level:
+                yield finished
+
+    def tree_snapshot(self):
+        """
+        Evaluates this queryset and returns a TreeSnapshot: a compact, read-only copy
+        of the tree holding only the pk, ltree and label of each node.
+
+        This is much cheaper than get_cached_trees() when you don't need
+        model instances, e.g. for menus or breadcrumbs.
+        """
+        rows = self.order_by("ltree").values_list("pk", "ltree", "label")
+        return TreeSnapshot(rows.iterator())
+
+    def as_nested_json(self, fields=None):
+        """
+        Returns the nodes in this queryset as a nested JSON document (UTF-8 bytes),
+        built entirely by the database, e.g.
+
+            [{"ltree": "a", "label": "a", "children": [{"ltree": "a.b", ...}]}]
+
+        Each node is an object of the given `fields` (the names of concrete fields,
+        or "pk"), plus "children". By default all concrete fields are included, keyed
+        by attname as for values(). Siblings are in ltree order.
+
+        Every node whose parent isn't in the queryset is at the top level, as for
+        iter_cached_trees(). (get_cached_trees() drops such nodes unless they're at
+        the queryset's lowest level.)
+
+        The document is assembled bottom-up, with one json_agg() per level, so no
+        Python objects are created per node: pass the result straight to an
+        HttpResponse. This takes two queries: one to find the range of levels in the
+        queryset, and one to build the document. Outside a transaction, they're run
+        in one REPEATABLE READ transaction, so they see the same nodes. Inside one,
+        that depends on the transaction's own isolation level.
+        """
+        db = self.db
+        connection = connections[db]
+        outermost = not connection.in_atomic_block
+        with transaction.atomic(using=db, savepoint=False):
+            if outermost and connection.isolation_level not in (
+                ISOLATION_LEVEL_REPEATABLE_READ,
+                ISOLATION_LEVEL_SERIALIZABLE,
+            ):
+                with connection.cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            return self._as_nested_json(connection, fields)
+
+    def _as_nested_json(self, connection, fields):
+        meta = self.model._meta
+        qs = self.order_by()
+        levels = qs.aggregate(
+            min_level=models.Min(Level("ltree")), max_level=models.Max(Level("ltree"))
+        )
+        if levels["min_level"] is None:
+            return b"[]"
+
+        if fields is None:
+            columns = [(f.attname, f.column) for f in meta.concrete_fields]
+        else:
+            columns = [
+                (name, (meta.pk if name == "pk" else meta.get_field(name)).column)
+                for name in fields
+            ]
+
+        qn = connection.ops.quote_name
+        pk_sql, params = qs.values("pk").query.get_compiler(using=connection.alias).as_sql()
+        params = list(params)
+        build_object = ", ".join("%%s, n.%s" % qn(column) for name, column in columns)
+
+        level_ctes = []
+        for level in range(levels["max_level"], levels["min_level"] - 1, -1):
+            if level == levels["max_level"]:
+                children_join = ""
+                children = "'[]'::json"
+            else:
+                children_join = """
+                    LEFT JOIN (
+                        SELECT mpathy_parent, json_agg(doc ORDER BY mpathy_ltree) AS children
+                        FROM level_%d
+                        GROUP BY mpathy_parent
+                    ) c ON c.mpathy_parent = n.mpathy_ltree
+                """ % (level + 1)
+                children = "coalesce(c.children, '[]'::json)"
+            level_ctes.append("""
+                level_%(level)d AS (
+                    SELECT n.mpathy_ltree, n.mpathy_parent,
+                        json_build_object(%(build_object)s, 'children', %(children)s) AS doc
+                    FROM nodes n %(children_join)s
+                    WHERE n.mpathy_level = %(level)d
+                )
+            """ % {
+                "level": level,
+                "build_object": build_object,
+                "children": children,
+                "children_join": children_join,
+            })
+            params.extend(name for name, column in columns)
+
+        sql = """
+            WITH nodes AS (
+                SELECT t.*,
+                    t.%(ltree)s AS mpathy_ltree,
+                    t.%(parent)s AS mpathy_parent,
+                    nlevel(t.%(ltree)s) AS mpathy_level
+                FROM %(table)s t
+                WHERE t.%(pk)s IN (%(pk_sql)s)
+            ),
+            %(level_ctes)s
+            SELECT coalesce(json_agg(doc ORDER BY mpathy_ltree), '[]'::json)::text
+            FROM (%(all_levels)s) d
+            WHERE NOT EXISTS (
+                SELECT 1 FROM nodes p WHERE p.mpathy_ltree = d.mpathy_parent
+            )
+        """ % {
+            "table": qn(meta.db_table),
+            "pk": qn(meta.pk.column),
+            "ltree": qn(meta.get_field("ltree").column),
+            "parent": qn(meta.get_field("parent").column),
+            "pk_sql": pk_sql,
+            "level_ctes": ",".join(level_ctes),
+            "all_levels": " UNION ALL ".join(
+                "SELECT mpathy_ltree, mpathy_parent, doc FROM level_%d" % level
+                for level in range(levels["min_level"], levels["max_level"] + 1)
+            ),
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()[0].encode("utf-8")
+
+    # Async versions of the methods which evaluate querysets. Django has no async
+    # database layer, so each one runs the whole sync method in a single
+    # sync_to_async() call: one thread hop per call, with both the queries and the
+    # tree assembly done off the event loop.
+
+    async def aget_cached_trees(self):
+        return await sync_to_async(self.get_cached_trees)()
+
+    async def atree_snapshot(self):
+        return await sync_to_async(self.tree_snapshot)()
+
+    async def adelete_subtrees(self, send_signals=True, collect_related=True):
+        return await sync_to_async(self.delete_subtrees)(
+            send_signals=send_signals, collect_related=collect_related
+        )
+
 
 class MPathManager(models.Manager.from_queryset(MPathQuerySet)):
-    def move_subtree(self, node, new_parent):
+    def delete_subtree(self, node, send_signals=True, collect_related=True):
+        """
+        Deletes a node and all its descendants with a single DELETE.
+        See MPathQuerySet.delete_subtrees() for the arguments.
+        """
+        result = self.filter(pk=node.pk).delete_subtrees(
+            send_signals=send_signals, collect_related=collect_related
+        )
+        setattr(node, node._meta.pk.attname, None)
+        return result
+
+    def bulk_create_tree(self, nodes, batch_size=1000):
+        """
+        Creates a whole tree (or forest) of nodes using batched multi-row INSERTs,
+        rather than one save() per node.
+
+        `nodes` may be either:
+         * a nested structure: an iterable of dicts, each with a 'label' key and an
+           optional 'children' key holding more such dicts. Any other keys are passed
+           to the model constructor.
+         * an iterable of (parent_path, label) rows. parent_path is None for root
+           nodes, and may refer to existing nodes or to nodes in the same call.
+
+        All ltree paths are computed in Python, and the nodes are inserted
+        parents-first. Returns the list of created nodes in that order.
+
+        NOTE: Like QuerySet.bulk_create(), this doesn't call save() or send any signals.
+        """
+        objs = []
+
+        def add_node(parent_path, label, fields):
+            if not label:
+                raise ValueError(
+                    "%s objects must have a label. Got: label=%r"
+                    % (self.model.__name__, label)
+                )
+            obj = self.model(label=label, parent_id=parent_path, **fields)
+            obj._set_ltree()
+            objs.append(obj)
+            return obj
+
+        def add_nested(parent_path, items):
+            for item in items:
+                fields = dict(item)
+                label = fields.pop("label", None)
+                children = fields.pop("children", None) or ()
+                obj = add_node(parent_path, label, fields)
+                add_nested(obj.ltree, children)
+
+        for item in nodes:
+            if isinstance(item, Mapping):
+                add_nested(None, [item])
+            else:
+                parent_path, label = item
+                add_node(parent_path or None, label, {})
+
+        # Parents first. The FK on parent is deferred so this isn't strictly necessary,
+        # but it keeps the inserted rows in a sensible order for the index.
+        objs.sort(key=lambda obj: obj.ltree.level())
+        objs = self.bulk_create(objs, batch_size=batch_size)
+
+        # Cached subtrees only need invalidating at the top of each new subtree
+        created = {obj.ltree for obj in objs}
+        invalidate_subtrees(
+            self.model,
+            [path for path in created if path.parent() not in created],
+            self._db or router.db_for_write(self.model, **self._hints),
+        )
+        return objs
+
+    def cached_subtree(self, path, max_depth=None):
+        """
+        Returns the node at `path`, with its descendants down to max_depth levels below
+        it already fetched (see prefetch_descendants()), from the subtree cache.
+
+        The cache is the one named by the MPATHY_SUBTREE_CACHE setting, with an
+        in-process LRU of MPATHY_SUBTREE_CACHE_SIZE entries in front of it. Entries
+        are invalidated when save(), delete() or this manager's bulk methods change
+        any path inside the subtree or on its ancestor chain, once the transaction
+        commits. Changes made with QuerySet.update() or raw SQL aren't noticed: call
+        mpathy.cache.invalidate_subtrees() after them.
+
+        The returned nodes are shared with other callers in this process, so treat
+        them as read-only. Raises DoesNotExist if there's no node at `path`.
+        """
+        subtree_cache = get_subtree_cache()
+        if subtree_cache is None:
+            raise ImproperlyConfigured(
+                "cached_subtree() needs the MPATHY_SUBTREE_CACHE setting"
+            )
+
+        def fill():
+            node = self.get(ltree=path)
+            prefetch_descendants([node], max_depth=max_depth)
+            return node
+
+        # Entries are keyed by the write database, which is the one invalidations
+        # are sent for, even when they're filled from a replica
+        db = self._db or router.db_for_write(self.model, **self._hints)
+        return subtree_cache.get(db, self.model._meta.db_table, path, max_depth, fill)
+
+    def lock_subtree(self, node, anchors=(), timeout=None, lock_rows=False):
+        """
+        A context manager which locks a node's subtree for the rest of the
+        transaction. See lock_subtrees().
+        """
+        return self.lock_subtrees(
+            [node], anchors=anchors, timeout=timeout, lock_rows=lock_rows
+        )
+
+    def lock_subtrees(self, nodes, anchors=(), timeout=None, lock_rows=False):
+        """
+        A context manager which runs its block in a transaction holding advisory locks
+        on the subtrees of the given nodes, e.g.
+
+            with Category.objects.lock_subtree(node, anchors=[new_parent], timeout=5):
+                ...
+
+        Locks on two subtrees only conflict when one contains the other, so work on
+        disjoint parts of the forest runs in parallel, and conflicting work waits
+        rather than failing at commit. `anchors` are nodes which mustn't move in the
+        meantime (but may have other subtrees locked below them).
+
+        If the locks can't be acquired within `timeout` seconds, raises
+        mpathy.locking.SubtreeLockTimeout. The node and anchor instances are refreshed
+        from the database once the locks are held. `lock_rows=True` also locks every
+        row in the subtrees with SELECT ... FOR UPDATE.
+
+        Locks are taken in a consistent order, so callers which take all the locks they
+        need in a single call can't deadlock with each other. The locks are released
+        when the outermost transaction ends.
+        """
+        return subtree_locks(
+            self.model,
+            nodes,
+            anchors=anchors,
+            timeout=timeout,
+            lock_rows=lock_rows,
+            using=self._db or router.db_for_write(self.model, **self._hints),
+        )
+
+    def move_subtree(self, node, new_parent, lock=False, lock_timeout=None):
         """
         Moves a node and all its descendants under the given new parent.
         If the parent is None, the node will become a root node.
@@ -45,12 +703,20 @@ class MPathManager(models.Manager.from_queryset(MPathQuerySet)):
 
         If node's parent is already new_parent, returns immediately.
 
+        With `lock=True`, the move holds the node's subtree lock (see lock_subtrees())
+        with new_parent as an anchor, so concurrent conflicting moves wait for each
+        other, and the instances are refreshed first.
+
         NOTE:
         This updates all the nodes in the database, and the current node instance.
         It cannot update any other node instances that are in memory, so if you have some
         whose ltree paths are affected by this function you may need to refresh them
         from the database.
         """
+        if lock:
+            with self.lock_subtree(node, anchors=[new_parent], timeout=lock_timeout):
+                return self.move_subtree(node, new_parent)
+
         if node.is_ancestor_of(new_parent, include_self=True):
             raise BadMove(
                 "%r can't be made a child of %r"
@@ -64,6 +730,7 @@ class MPathManager(models.Manager.from_queryset(MPathQuerySet)):
         elif new_parent is not None and node.ltree.parent() == new_parent.ltree:
             return
 
+        old_ltree = node.ltree
         old_parent_ltree = node.ltree.parent()
         old_parent_level = old_parent_ltree.level() if old_parent_ltree else -1
 
@@ -104,6 +771,317 @@ class MPathManager(models.Manager.from_queryset(MPathQuerySet)):
         node.parent = new_parent
         node._set_ltree()
         node.save(update_fields=["parent"])
+        db = self._db or router.db_for_write(self.model, **self._hints)
+        invalidate_subtrees(self.model, [old_ltree, node.ltree], db)
+
+    def relabel(self, node, new_label):
+        """
+        Changes the label of a node, and rewrites the ltree (and parent) of the node
+        and all its descendants to match, in a single UPDATE.
+
+        NOTE:
+        As with move_subtree(), this updates the given node instance, but any other
+        affected node instances in memory will need to be refreshed from the database.
+        """
+        if not new_label or "." in new_label:
+            raise ValueError(
+                "%s labels must be non-empty and can't contain '.'. Got: %r"
+                % (node.__class__.__name__, new_label)
+            )
+        if new_label == node.label:
+            return
+
+        parent_ltree = node.ltree.parent()
+        if parent_ltree is None:
+            new_ltree = LTree(new_label)
+        else:
+            new_ltree = LTree("%s.%s" % (parent_ltree, new_label))
+
+        # For descendants: the new path, plus the part of their path below the node.
+        # i.e. when relabelling 'a.b' to 'a.c', 'a.b.d.e' becomes 'a.c' || 'd.e'
+        descendant_ltree_expr = CombinedExpression(
+            lhs=RawSQL("%s::ltree", [new_ltree]),
+            connector="||",
+            rhs=Subpath(models.F("ltree"), node.ltree.level() + 1),
+        )
+        self.filter(ltree__descendant_or_equal=node.ltree).update(
+            ltree=models.Case(
+                models.When(pk=node.pk, then=models.Value(new_ltree)),
+                default=descendant_ltree_expr,
+                output_field=node.__class__._meta.get_field("ltree"),
+            ),
+            # Update parent at the same time as ltree, otherwise the check constraint fails
+            parent=models.Case(
+                models.When(pk=node.pk, then=models.F("parent")),
+                default=Subpath(descendant_ltree_expr, 0, -1),
+                output_field=node.__class__._meta.get_field("parent"),
+            ),
+            label=models.Case(
+                models.When(pk=node.pk, then=models.Value(new_label)),
+                default=models.F("label"),
+            ),
+        )
+
+        db = self._db or router.db_for_write(self.model, **self._hints)
+        invalidate_subtrees(self.model, [node.ltree, new_ltree], db)
+
+        # Update node in memory
+        node.label = new_label
+        node.ltree = new_ltree
+
+    def copy_subtree(self, node, new_parent, label=None, return_mapping=False):
+        """
+        Copies a node and all its descendants under the given new parent (or makes the
+        copy a root node if new_parent is None), using a single INSERT ... SELECT.
+        All other concrete fields are copied as they are.
+
+        If label is given, the copy of `node` is given that label.
+
+        Returns the new copy of `node`. If return_mapping is True, returns a
+        (new_node, {old_pk: new_pk}) tuple instead, for copying related data.
+        """
+        meta = self.model._meta
+        if not getattr(meta.pk, "db_returning", False):
+            raise ValueError(
+                "copy_subtree() needs %s to have an auto-incrementing primary key"
+                % self.model.__name__
+            )
+        label = label or node.label
+        if new_parent is None:
+            new_ltree = LTree(label)
+        else:
+            new_ltree = LTree("%s.%s" % (new_parent.ltree, label))
+
+        db = self._db or router.db_for_write(self.model, **self._hints)
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        special = {"ltree", "parent", "label"}
+        other_columns = [
+            qn(f.column)
+            for f in meta.concrete_fields
+            if not f.primary_key and f.name not in special
+        ]
+        ltree_col = qn(meta.get_field("ltree").column)
+        parent_col = qn(meta.get_field("parent").column)
+        label_col = qn(meta.get_field("label").column)
+        pk_col = qn(meta.pk.column)
+
+        sql = """
+            WITH source AS (
+                SELECT s.*,
+                    CASE WHEN s.%(ltree)s = %%(old)s::ltree THEN %%(new)s::ltree
+                    ELSE %%(new)s::ltree || subpath(s.%(ltree)s, %%(level)s)
+                    END AS mpathy_new_ltree
+                FROM %(table)s s
+                WHERE s.%(ltree)s <@ %%(old)s::ltree
+            ),
+            inserted AS (
+                INSERT INTO %(table)s (%(ltree)s, %(parent)s, %(label)s%(columns)s)
+                SELECT
+                    mpathy_new_ltree,
+                    CASE WHEN %(ltree)s = %%(old)s::ltree THEN %%(new_parent)s::ltree
+                    ELSE subpath(mpathy_new_ltree, 0, -1)
+                    END,
+                    CASE WHEN %(ltree)s = %%(old)s::ltree THEN %%(label)s
+                    ELSE %(label)s
+                    END
+                    %(columns)s
+                FROM source
+                RETURNING %(pk)s, %(ltree)s
+            )
+            SELECT source.%(pk)s, inserted.%(pk)s
+            FROM source JOIN inserted ON inserted.%(ltree)s = source.mpathy_new_ltree
+        """ % {
+            "table": qn(meta.db_table),
+            "pk": pk_col,
+            "ltree": ltree_col,
+            "parent": parent_col,
+            "label": label_col,
+            "columns": "".join(", %s" % col for col in other_columns),
+        }
+        params = {
+            "old": node.ltree,
+            "new": new_ltree,
+            "new_parent": new_parent.ltree if new_parent is not None else None,
+            "level": node.ltree.level() + 1,
+            "label": label,
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            mapping = dict(cursor.fetchall())
+        invalidate_subtrees(self.model, [new_ltree], db)
+
+        new_node = self.using(db).get(pk=mapping[node.pk])
+        if return_mapping:
+            return new_node, mapping
+        return new_node
+
+    def move_subtrees(self, moves, lock=False, lock_timeout=None):
+        """
+        Moves many subtrees at once. `moves` is an iterable of (node, new_parent) pairs,
+        with the same meaning as the arguments to move_subtree().
+
+        All affected nodes are rewritten with a single UPDATE, which joins the table
+        against a VALUES list mapping each moved node's path to its new parent's path.
+
+        A new parent may be inside another moved subtree; it is placed at its
+        post-move location. Raises BadMove if any node would end up inside its own
+        subtree (directly or via other moves in the batch), or if one moved node is
+        inside another moved node's subtree.
+
+        NOTE:
+        This updates all the nodes in the database, and the given node and new_parent
+        instances. As with move_subtree(), any other affected node instances in memory
+        will need to be refreshed from the database.
+
+        `lock` and `lock_timeout` are the same as for move_subtree(). All the subtree
+        locks are taken at once.
+        """
+        if lock:
+            moves = list(moves)
+            with self.lock_subtrees(
+                [node for node, new_parent in moves],
+                anchors=[new_parent for node, new_parent in moves],
+                timeout=lock_timeout,
+            ):
+                return self.move_subtrees(moves)
+
+        sources = {}
+        for node, new_parent in moves:
+            new_parent_ltree = new_parent.ltree if new_parent is not None else None
+            if node.ltree in sources:
+                raise BadMove("%r is moved more than once" % (node.ltree,))
+            if node.is_ancestor_of(new_parent, include_self=True):
+                raise BadMove(
+                    "%r can't be made a child of %r" % (node.ltree, new_parent_ltree)
+                )
+            if (node.parent_id or None) == new_parent_ltree:
+                # Nothing to do
+                continue
+            sources[node.ltree] = (node, new_parent)
+
+        def containing_source(path):
+            path = path.parent()
+            while path is not None:
+                if path in sources:
+                    return path
+                path = path.parent()
+            return None
+
+        for path in sources:
+            ancestor = containing_source(path)
+            if ancestor is not None:
+                raise BadMove(
+                    "%r can't be moved at the same time as its ancestor %r"
+                    % (path, ancestor)
+                )
+
+        new_paths = {}
+
+        def resolve(path, seen=()):
+            """
+            Returns the path that `path` will have once all the moves are done.
+            """
+            source = path if path in sources else containing_source(path)
+            if source is None:
+                return path
+            if source in seen:
+                raise BadMove(
+                    "Moving %r would make it a descendant of itself" % (source,)
+                )
+            if source not in new_paths:
+                new_parent = sources[source][1]
+                label = source.labels()[-1]
+                if new_parent is None:
+                    new_paths[source] = LTree(label)
+                else:
+                    parent_path = resolve(new_parent.ltree, seen + (source,))
+                    new_paths[source] = LTree("%s.%s" % (parent_path, label))
+            return LTree(new_paths[source] + path[len(source):])
+
+        values = []
+        for path, (node, new_parent) in sources.items():
+            resolve(path)
+            values.append((path, new_paths[path].parent()))
+
+        if not values:
+            return
+
+        meta = self.model._meta
+        db = self._db or router.db_for_write(self.model, **self._hints)
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        ltree_col = qn(meta.get_field("ltree").column)
+        parent_col = qn(meta.get_field("parent").column)
+        # The tail of each row's path, starting at the moved node's own label.
+        tail = "subpath(t.%s, nlevel(m.old_path) - 1)" % ltree_col
+        new_ltree = (
+            "CASE WHEN m.new_parent IS NULL THEN %s ELSE m.new_parent || %s END"
+            % (tail, tail)
+        )
+        sql = """
+            UPDATE %(table)s AS t SET
+                %(ltree)s = %(new_ltree)s,
+                %(parent)s = CASE
+                    WHEN t.%(ltree)s = m.old_path THEN m.new_parent
+                    ELSE subpath(%(new_ltree)s, 0, -1)
+                END
+            FROM (VALUES %(values)s) AS m(old_path, new_parent)
+            WHERE t.%(ltree)s <@ m.old_path
+        """ % {
+            "table": qn(meta.db_table),
+            "ltree": ltree_col,
+            "parent": parent_col,
+            "new_ltree": new_ltree,
+            "values": ", ".join(["(%s::ltree, %s::ltree)"] * len(values)),
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [p for pair in values for p in pair])
+        invalidate_subtrees(
+            self.model, [path for pair in new_paths.items() for path in pair], db
+        )
+
+        # Update the given instances in memory. Work out all the new paths before
+        # changing anything, since the same instance may appear more than once.
+        new_parent_paths = [
+            (new_parent, resolve(new_parent.ltree))
+            for node, new_parent in sources.values()
+            if new_parent is not None
+        ]
+        for new_parent, path in new_parent_paths:
+            new_parent.ltree = path
+            new_parent.parent_id = path.parent()
+        for path, (node, new_parent) in sources.items():
+            node.ltree = new_paths[path]
+            node.parent = new_parent
+
+    # Async versions of the methods above. See the note on MPathQuerySet's.
+
+    async def adelete_subtree(self, node, send_signals=True, collect_related=True):
+        return await sync_to_async(self.delete_subtree)(
+            node, send_signals=send_signals, collect_related=collect_related
+        )
+
+    async def abulk_create_tree(self, nodes, batch_size=1000):
+        return await sync_to_async(self.bulk_create_tree)(nodes, batch_size=batch_size)
+
+    async def amove_subtree(self, node, new_parent, lock=False, lock_timeout=None):
+        return await sync_to_async(self.move_subtree)(
+            node, new_parent, lock=lock, lock_timeout=lock_timeout
+        )
+
+    async def amove_subtrees(self, moves, lock=False, lock_timeout=None):
+        return await sync_to_async(self.move_subtrees)(
+            moves, lock=lock, lock_timeout=lock_timeout
+        )
+
+    async def arelabel(self, node, new_label):
+        return await sync_to_async(self.relabel)(node, new_label)
+
+    async def acopy_subtree(self, node, new_parent, label=None, return_mapping=False):
+        return await sync_to_async(self.copy_subtree)(
+            node, new_parent, label=label, return_mapping=return_mapping
+        )
 
 
 class MPathNode(models.Model):
@@ -126,10 +1104,8 @@ class MPathNode(models.Model):
 
     class Meta:
         abstract = True
-        indexes = [
-            GistIndex(fields=["ltree"]),
-            GistIndex(fields=["parent"]),
-        ]
+        # To choose different index types for a model, see mpath_indexes()
+        indexes = mpath_indexes()
 
     def _set_ltree(self):
         if self.parent_id:
@@ -151,9 +1127,21 @@ class MPathNode(models.Model):
         # NOTE: This only works for leaf nodes, so shouldnt be relied on.
         # It's here as a convenience so you can create nodes with a pre-set parent.
         # For *changing* parent of an existing node, use MPathManager.move_subtree()
+        old_ltree = self.ltree
         self._set_ltree()
 
-        return super(MPathNode, self).save(**kwargs)
+        result = super(MPathNode, self).save(**kwargs)
+        invalidate_subtrees(
+            self.__class__, {path for path in (old_ltree, self.ltree) if path}, self._state.db
+        )
+        return result
+
+    def delete(self, using=None, keep_parents=False):
+        using = using or router.db_for_write(self.__class__, instance=self)
+        ltree = self.ltree
+        result = super(MPathNode, self).delete(using=using, keep_parents=keep_parents)
+        invalidate_subtrees(self.__class__, [ltree], using)
+        return result
 
     def is_ancestor_of(self, other, include_self=False):
         if other is None:
@@ -165,6 +1153,24 @@ class MPathNode(models.Model):
             return True
         return self.ltree.is_descendant_of(other.ltree, include_self=include_self)
 
+    def is_leaf_node(self):
+        """
+        Returns True if this node has no children.
+
+        Doesn't query the database if the node's children are cached (see
+        get_cached_trees()), or if it was annotated using qs.with_is_leaf(),
+        qs.with_child_count() or qs.with_descendant_count().
+        """
+        if hasattr(self, "_cached_children"):
+            return not self._cached_children
+        if hasattr(self, "is_leaf"):
+            return self.is_leaf
+        if hasattr(self, "child_count"):
+            return not self.child_count
+        if hasattr(self, "descendant_count"):
+            return not self.descendant_count
+        return not self.get_children().exists()
+
     def get_siblings(self, include_self=False):
         """
         Returns a queryset of this node's siblings, using the default manager.
@@ -184,19 +1190,31 @@ class MPathNode(models.Model):
         """
         try:
             # Shortcut the database if this node has been fetched using
-            # qs.get_cached_trees()
+            # qs.get_cached_trees() or qs.prefetch_descendants()
             return self._cached_children
         except AttributeError:
             mgr = self.__class__._default_manager
             return mgr.filter(ltree__lquery=self.ltree.children_lquery())
 
-    def get_descendants(self, include_self=False):
+    def get_descendants(self, include_self=False, min_depth=None, max_depth=None):
         """
         Returns a queryset of descendants for this node, using the default manager.
 
         If include_self=True is given, the queryset will include this node.
+
+        If min_depth or max_depth are given, only descendants between those many
+        levels below this node are included (children are at depth 1). This is done
+        with a single lquery, which the ltree index can answer directly. Raises
+        ValueError if a depth is negative, or min_depth is greater than max_depth.
         """
         mgr = self.__class__._default_manager
+        if min_depth is not None or max_depth is not None:
+            if min_depth is None:
+                min_depth = 0 if include_self else 1
+            return mgr.filter(
+                ltree__lquery=self.ltree.descendants_lquery(max_depth, min_depth)
+            )
+
         qs = mgr.filter(ltree__descendant_or_equal=self.ltree)
 
         if not include_self:
@@ -206,12 +1224,79 @@ class MPathNode(models.Model):
     def get_ancestors(self, include_self=False):
         """
         Returns a queryset of ancestors for this node, using the default manager.
+        If the ancestors were fetched with qs.prefetch_ancestors(), returns a list
+        of them instead, ordered from the root down.
 
         If include_self=True is given, the queryset will include this node.
         """
+        try:
+            # Shortcut the database if this node has been fetched using
+            # qs.prefetch_ancestors()
+            ancestors = self._cached_ancestors
+        except AttributeError:
+            pass
+        else:
+            return ancestors + [self] if include_self else list(ancestors)
+
         mgr = self.__class__._default_manager
         qs = mgr.filter(ltree__ancestor_or_equal=self.ltree)
 
         if not include_self:
             qs = qs.exclude(ltree=self.ltree)
         return qs
+
+    # Async versions of the methods above. They return lists rather than querysets,
+    # since the queries are run in a single sync_to_async() call.
+
+    async def ais_leaf_node(self):
+        return await sync_to_async(self.is_leaf_node)()
+
+    async def aget_siblings(self, include_self=False):
+        return await sync_to_async(list)(self.get_siblings(include_self=include_self))
+
+    async def aget_children(self):
+        return await sync_to_async(list)(self.get_children())
+
+    async def aget_descendants(self, include_self=False, min_depth=None, max_depth=None):
+        return await sync_to_async(list)(
+            self.get_descendants(
+                include_self=include_self, min_depth=min_depth, max_depth=max_depth
+            )
+        )
+
+    async def aget_ancestors(self, include_self=False):
+        return await sync_to_async(list)(self.get_ancestors(include_self=include_self))
+
+
+class CountedMPathNode(MPathNode):
+    """
+    An MPathNode which also stores the number of children and descendants of each
+    node. These are kept up to date by database triggers (installed after migrating),
+    so they're always correct in the database even for changes made with
+    QuerySet.update() or raw SQL.
+
+    NOTE: As with moves, instances in memory aren't updated when their counts change.
+    Use refresh_from_db() if you need the current values.
+    """
+
+    child_count = models.PositiveIntegerField(default=0, editable=False)
+    descendant_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta(MPathNode.Meta):
+        abstract = True
+
+    def save(self, **kwargs):
+        # The counts are maintained by the database, so don't overwrite them with
+        # whatever was in memory when updating an existing node.
+        if (
+            not self._state.adding
+            and not kwargs.get("force_insert")
+            and kwargs.get("update_fields") is None
+        ):
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key
+                and f.name not in ("child_count", "descendant_count")
+            ]
+        return super(CountedMPathNode, self).save(**kwargs)
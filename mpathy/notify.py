@@ -0,0 +1,151 @@
+import json
+import logging
+import select
+import threading
+
+import psycopg2
+from psycopg2.extensions import quote_ident
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from .cache import get_subtree_cache
+from .models import MPathNode
+
+logger = logging.getLogger(__name__)
+
+
+class SubtreeChangeListener:
+    """
+    Listens for the notifications sent by the triggers which post_migrate installs
+    when the MPATHY_NOTIFY_CHANNEL setting is set, and passes the changed paths to
+    `handler(db_table, paths)`. `paths` are the roots of the changed subtrees, or None
+    if anything in the table may have changed.
+
+    The default handler invalidates the affected entries in the subtree cache (see
+    MPathManager.cached_subtree()). Unlike the invalidation done by mpathy's own
+    methods, this also catches QuerySet.update(), raw SQL and other services.
+
+    The listener has its own database connection. Either call poll() from your own
+    loop, or start() a background thread, e.g. in AppConfig.ready():
+
+        SubtreeChangeListener().start()
+
+    Notifications sent while the listener isn't connected are lost. When run() loses
+    its connection, it reconnects with exponential backoff, then passes None as the
+    paths for every MPathNode table, since anything may have changed in the meantime.
+    Exceptions raised by the handler are logged, and don't stop the listener.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS, channel=None, handler=None):
+        self.using = using
+        self.channel = channel or getattr(settings, "MPATHY_NOTIFY_CHANNEL", None)
+        if not self.channel:
+            raise ImproperlyConfigured(
+                "SubtreeChangeListener needs a channel, or the MPATHY_NOTIFY_CHANNEL setting"
+            )
+        self.handler = handler or self.invalidate
+        self.connection = None
+        self._stopped = threading.Event()
+
+    def connect(self):
+        wrapper = connections[self.using]
+        conn = wrapper.get_new_connection(wrapper.get_connection_params())
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("LISTEN %s" % quote_ident(self.channel, conn))
+        self.connection = conn
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
+
+    def poll(self, timeout=None):
+        """
+        Waits up to `timeout` seconds (forever if None) for notifications, and handles
+        any that arrive. Returns the number handled.
+        """
+        if self.connection is None:
+            self.connect()
+        conn = self.connection
+        if not conn.notifies:
+            select.select([conn], [], [], timeout)
+        conn.poll()
+        notifies = list(conn.notifies)
+        del conn.notifies[:]
+        for notify in notifies:
+            try:
+                payload = json.loads(notify.payload)
+                self.handler(payload["table"], payload["paths"])
+            except Exception:
+                logger.exception("Error handling subtree change notification %r", notify.payload)
+        return len(notifies)
+
+    def handle_all(self):
+        """
+        Tells the handler that anything in any MPathNode table may have changed.
+        """
+        for model in apps.get_models():
+            if issubclass(model, MPathNode):
+                try:
+                    self.handler(model._meta.db_table, None)
+                except Exception:
+                    logger.exception(
+                        "Error handling subtree changes to %s", model._meta.db_table
+                    )
+
+    def invalidate(self, db_table, paths):
+        subtree_cache = get_subtree_cache()
+        if subtree_cache is None:
+            return
+        if paths is None:
+            subtree_cache.invalidate_all(self.using, db_table)
+        else:
+            subtree_cache.invalidate(self.using, db_table, paths)
+
+    def run(self, poll_interval=5, retry_interval=1, max_retry_interval=60):
+        """
+        Handles notifications until stop() is called. If the connection fails,
+        reconnects after retry_interval seconds, doubling up to max_retry_interval
+        while it keeps failing, and then calls handle_all().
+        """
+        delay = retry_interval
+        disconnected = False
+        try:
+            while not self._stopped.is_set():
+                try:
+                    if self.connection is None:
+                        self.connect()
+                        if disconnected:
+                            self.handle_all()
+                            disconnected = False
+                    self.poll(poll_interval)
+                    delay = retry_interval
+                except psycopg2.Error:
+                    logger.exception(
+                        "Subtree change listener lost its connection, reconnecting in %ss",
+                        delay,
+                    )
+                    self.close()
+                    disconnected = True
+                    self._stopped.wait(delay)
+                    delay = min(delay * 2, max_retry_interval)
+        finally:
+            self.close()
+
+    def start(self):
+        """
+        Runs the listener in a daemon thread, and returns the thread.
+        """
+        self._stopped.clear()
+        thread = threading.Thread(target=self.run, name="mpathy-listener", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopped.set()
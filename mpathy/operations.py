@@ -1,12 +1,13 @@
 from psycopg2.extensions import quote_ident
 
 from django.apps import apps as global_apps
+from django.conf import settings
 from django.contrib.postgres.operations import CreateExtension
 from django.core.exceptions import FieldDoesNotExist
 from django.db import connection, DEFAULT_DB_ALIAS, migrations
 
 from .fields import LTreeField
-from .models import MPathNode
+from .models import MPathNode, has_count_fields
 
 
 class LTreeExtension(CreateExtension):
@@ -31,6 +32,329 @@ def inject_pre_migration_operations(plan=None, apps=global_apps, using=DEFAULT_D
                         return
 
 
+# Statement-level trigger functions which keep child_count and descendant_count up
+# to date. Each one builds a `changes` set of (pk, old_ltree, new_ltree) from the
+# statement's transition tables, then adjusts the counts of every ancestor of the
+# old and new paths by the net change, so moving a subtree costs O(rows * depth).
+COUNT_TRIGGER_CHANGES = {
+    'INSERT': '''
+        SELECT %(pk)s AS pk, NULL::ltree AS old_ltree, ltree AS new_ltree
+        FROM new_rows
+    ''',
+    'UPDATE': '''
+        SELECT n.%(pk)s AS pk, o.ltree AS old_ltree, n.ltree AS new_ltree
+        FROM old_rows o JOIN new_rows n ON o.%(pk)s = n.%(pk)s
+        WHERE o.ltree IS DISTINCT FROM n.ltree
+    ''',
+    'DELETE': '''
+        SELECT %(pk)s AS pk, ltree AS old_ltree, NULL::ltree AS new_ltree
+        FROM old_rows
+    ''',
+}
+
+COUNT_TRIGGER_TRANSITION_TABLES = {
+    'INSERT': 'NEW TABLE AS new_rows',
+    'UPDATE': 'OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'DELETE': 'OLD TABLE AS old_rows',
+}
+
+COUNT_TRIGGER_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION %(function)s() RETURNS trigger AS $$
+    BEGIN
+        -- Updating the counts fires the UPDATE trigger again, with no path changes.
+        IF NOT EXISTS (%(changes)s) THEN
+            RETURN NULL;
+        END IF;
+
+        WITH changes AS (%(changes)s),
+        adjustments AS (
+            SELECT subpath(c.new_ltree, 0, i) AS ltree,
+                CASE WHEN i = nlevel(c.new_ltree) - 1 THEN 1 ELSE 0 END AS child_delta,
+                1 AS descendant_delta
+            FROM changes c, generate_series(1, nlevel(c.new_ltree) - 1) AS i
+            WHERE c.new_ltree IS NOT NULL
+            UNION ALL
+            -- Adjustments to old ancestor paths apply to whichever row had that path
+            -- before this statement, wherever it is now.
+            SELECT coalesce(moved.new_ltree, a.ltree), a.child_delta, a.descendant_delta
+            FROM (
+                SELECT subpath(c.old_ltree, 0, i) AS ltree,
+                    CASE WHEN i = nlevel(c.old_ltree) - 1 THEN -1 ELSE 0 END AS child_delta,
+                    -1 AS descendant_delta
+                FROM changes c, generate_series(1, nlevel(c.old_ltree) - 1) AS i
+                WHERE c.old_ltree IS NOT NULL
+            ) a
+            LEFT JOIN changes moved ON moved.old_ltree = a.ltree
+        ),
+        totals AS (
+            SELECT ltree,
+                sum(child_delta) AS child_delta,
+                sum(descendant_delta) AS descendant_delta
+            FROM adjustments
+            GROUP BY ltree
+        )
+        UPDATE %(table)s AS t SET
+            %(child_count)s = t.%(child_count)s + totals.child_delta,
+            %(descendant_count)s = t.%(descendant_count)s + totals.descendant_delta
+        FROM totals
+        WHERE t.ltree = totals.ltree
+            AND (totals.child_delta <> 0 OR totals.descendant_delta <> 0)
+            AND t.%(pk)s NOT IN (SELECT pk FROM changes WHERE old_ltree IS NULL);
+
+        %(recount)s
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+'''
+
+# New rows may be inserted after their descendants (the parent FK is deferred), so
+# their own counts are calculated from scratch.
+COUNT_TRIGGER_RECOUNT_INSERTED = '''
+    UPDATE %(table)s AS t SET
+        %(child_count)s = (SELECT count(*) FROM %(table)s c WHERE c.parent_id = t.ltree),
+        %(descendant_count)s = (SELECT count(*) FROM %(table)s d WHERE d.ltree <@ t.ltree) - 1
+    WHERE t.%(pk)s IN (SELECT %(pk)s FROM new_rows);
+'''
+
+
+def install_count_triggers(model, cur):
+    """
+    Installs triggers which keep child_count and descendant_count up to date
+    whenever nodes are inserted, deleted or moved.
+    """
+    db_table = model._meta.db_table
+    names = {
+        "table": quote_ident(db_table, connection.connection),
+        "pk": quote_ident(model._meta.pk.column, connection.connection),
+        "child_count": quote_ident(
+            model._meta.get_field('child_count').column, connection.connection
+        ),
+        "descendant_count": quote_ident(
+            model._meta.get_field('descendant_count').column, connection.connection
+        ),
+    }
+    for op, changes in COUNT_TRIGGER_CHANGES.items():
+        name = quote_ident('%s__counts_%s' % (db_table, op.lower()), connection.connection)
+        op_names = dict(
+            names,
+            op=op,
+            function=name,
+            trigger=name,
+            transition_tables=COUNT_TRIGGER_TRANSITION_TABLES[op],
+            changes=changes % names,
+            recount=COUNT_TRIGGER_RECOUNT_INSERTED % names if op == 'INSERT' else '',
+        )
+        cur.execute(COUNT_TRIGGER_FUNCTION % op_names)
+        cur.execute('''
+            CREATE TRIGGER %(trigger)s AFTER %(op)s ON %(table)s
+            REFERENCING %(transition_tables)s
+            FOR EACH STATEMENT EXECUTE PROCEDURE %(function)s()
+        ''' % op_names)
+
+
+# The forms of the check that every node's ltree is consistent with its parent_id.
+# The MPATHY_LTREE_CHECK setting chooses the one installed by post_migrate_mpathnode:
+#  * 'lquery' (the default) is a CHECK constraint which builds an lquery from each
+#    row's parent_id. Parsing the lquery dominates the cost of big bulk writes.
+#  * 'functions' is a CHECK constraint using only ltree functions and operators,
+#    so nothing is parsed.
+#  * 'trigger' checks all the new rows of each INSERT or UPDATE statement at once,
+#    in statement-level triggers, with the same condition as 'functions'.
+LTREE_CHECK_FORMS = ('lquery', 'functions', 'trigger')
+
+LTREE_CHECK_CONDITIONS = {
+    'lquery': '''
+        (parent_id IS NOT NULL AND ltree ~ (parent_id::text || '.*{1}')::lquery)
+        OR (parent_id IS NULL AND ltree ~ '*{1}'::lquery)
+    ''',
+    'functions': '''
+        (parent_id IS NOT NULL AND parent_id @> ltree AND nlevel(ltree) = nlevel(parent_id) + 1)
+        OR (parent_id IS NULL AND nlevel(ltree) = 1)
+    ''',
+}
+LTREE_CHECK_CONDITIONS['trigger'] = LTREE_CHECK_CONDITIONS['functions']
+
+LTREE_CHECK_TRIGGER_OPS = ('INSERT', 'UPDATE')
+
+LTREE_CHECK_TRIGGER_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION %(function)s() RETURNS trigger AS $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM new_rows WHERE NOT (%(condition)s)) THEN
+            RAISE EXCEPTION 'new row for relation "%%" violates check trigger "%%"',
+                TG_TABLE_NAME, TG_NAME
+                USING ERRCODE = 'check_violation';
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+'''
+
+
+def _ltree_check_names(model):
+    db_table = model._meta.db_table
+    return {
+        "table": quote_ident(db_table, connection.connection),
+        "check_constraint": quote_ident('%s__check_ltree' % db_table, connection.connection),
+        "triggers": [
+            (op, quote_ident('%s__check_ltree_%s' % (db_table, op.lower()), connection.connection))
+            for op in LTREE_CHECK_TRIGGER_OPS
+        ],
+    }
+
+
+def install_ltree_check(model, cur, form=None):
+    """
+    Installs the check that each node's ltree is consistent with its parent_id.
+    `form` is one of LTREE_CHECK_FORMS, and defaults to the MPATHY_LTREE_CHECK setting.
+    """
+    if form is None:
+        form = getattr(settings, 'MPATHY_LTREE_CHECK', 'lquery')
+    if form not in LTREE_CHECK_FORMS:
+        raise ValueError(
+            "Unknown ltree check %r. Expected one of %s"
+            % (form, ", ".join(LTREE_CHECK_FORMS))
+        )
+
+    names = dict(_ltree_check_names(model), condition=LTREE_CHECK_CONDITIONS[form])
+    if form != 'trigger':
+        cur.execute('''
+            ALTER TABLE %(table)s ADD CONSTRAINT %(check_constraint)s CHECK (%(condition)s)
+        ''' % names)
+        return
+
+    for op, name in names["triggers"]:
+        op_names = dict(names, op=op, function=name, trigger=name)
+        cur.execute(LTREE_CHECK_TRIGGER_FUNCTION % op_names)
+        # Transition tables can't be combined with a column list (UPDATE OF ...),
+        # so updates which don't change any paths are checked too.
+        cur.execute('''
+            CREATE TRIGGER %(trigger)s AFTER %(op)s ON %(table)s
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE PROCEDURE %(function)s()
+        ''' % op_names)
+
+
+def drop_ltree_check(model, cur):
+    """
+    Removes the check installed by install_ltree_check(), whichever form it has.
+    """
+    names = _ltree_check_names(model)
+    cur.execute(
+        'ALTER TABLE %(table)s DROP CONSTRAINT IF EXISTS %(check_constraint)s' % names
+    )
+    for op, name in names["triggers"]:
+        cur.execute('DROP TRIGGER IF EXISTS %s ON %s' % (name, names["table"]))
+        cur.execute('DROP FUNCTION IF EXISTS %s()' % name)
+
+
+# Statement-level trigger functions which send a notification on the channel named by
+# the MPATHY_NOTIFY_CHANNEL setting whenever nodes change, for SubtreeChangeListener.
+# The payload is JSON: {"table": ..., "paths": [...]}, where the paths are the changed
+# paths whose parents didn't change (i.e. the roots of the changed subtrees).
+# Notifications can't be longer than 8000 bytes, so if there are too many paths only
+# their roots are sent, and if there are still too many, "paths" is null, meaning
+# anything in the table may have changed.
+NOTIFY_TRIGGER_CHANGES = {
+    'INSERT': 'SELECT ltree AS path FROM new_rows',
+    'UPDATE': 'SELECT ltree AS path FROM old_rows UNION SELECT ltree FROM new_rows',
+    'DELETE': 'SELECT ltree AS path FROM old_rows',
+}
+
+NOTIFY_TRIGGER_MAX_LENGTH = 7000
+
+NOTIFY_TRIGGER_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION %(function)s() RETURNS trigger AS $$
+    DECLARE
+        paths json;
+    BEGIN
+        WITH changed AS (%(changes)s)
+        SELECT json_agg(c.path::text) INTO paths
+        FROM changed c
+        WHERE nlevel(c.path) = 1
+            OR NOT EXISTS (SELECT 1 FROM changed p WHERE p.path = subpath(c.path, 0, -1));
+        IF paths IS NULL THEN
+            RETURN NULL;
+        END IF;
+
+        IF length(paths::text) > %(max_length)d THEN
+            WITH changed AS (%(changes)s)
+            SELECT json_agg(DISTINCT subpath(path, 0, 1)::text) INTO paths FROM changed;
+        END IF;
+        IF length(paths::text) > %(max_length)d THEN
+            paths := NULL;
+        END IF;
+
+        PERFORM pg_notify(
+            %(channel)s,
+            json_build_object('table', TG_TABLE_NAME, 'paths', paths)::text
+        );
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+'''
+
+# TRUNCATE has no transition tables, so it always invalidates the whole table.
+NOTIFY_TRIGGER_TRUNCATE_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION %(function)s() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify(
+            %(channel)s,
+            json_build_object('table', TG_TABLE_NAME, 'paths', NULL)::text
+        );
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+'''
+
+
+def _notify_trigger_names(model):
+    db_table = model._meta.db_table
+    return [
+        (op, quote_ident('%s__notify_%s' % (db_table, op.lower()), connection.connection))
+        for op in ('INSERT', 'UPDATE', 'DELETE', 'TRUNCATE')
+    ]
+
+
+def install_notify_triggers(model, cur, channel):
+    """
+    Installs triggers which send the paths of changed nodes to the given
+    LISTEN/NOTIFY channel, for mpathy.notify.SubtreeChangeListener.
+    """
+    names = {
+        "table": quote_ident(model._meta.db_table, connection.connection),
+        # A string literal, not an identifier
+        "channel": "'%s'" % channel.replace("'", "''"),
+        "max_length": NOTIFY_TRIGGER_MAX_LENGTH,
+    }
+    for op, name in _notify_trigger_names(model):
+        op_names = dict(names, op=op, function=name, trigger=name)
+        if op == 'TRUNCATE':
+            cur.execute(NOTIFY_TRIGGER_TRUNCATE_FUNCTION % op_names)
+            cur.execute('''
+                CREATE TRIGGER %(trigger)s AFTER TRUNCATE ON %(table)s
+                FOR EACH STATEMENT EXECUTE PROCEDURE %(function)s()
+            ''' % op_names)
+            continue
+
+        op_names["changes"] = NOTIFY_TRIGGER_CHANGES[op]
+        cur.execute(NOTIFY_TRIGGER_FUNCTION % op_names)
+        cur.execute('''
+            CREATE TRIGGER %(trigger)s AFTER %(op)s ON %(table)s
+            REFERENCING %(transition_tables)s
+            FOR EACH STATEMENT EXECUTE PROCEDURE %(function)s()
+        ''' % dict(op_names, transition_tables=COUNT_TRIGGER_TRANSITION_TABLES[op]))
+
+
+def drop_notify_triggers(model, cur):
+    """
+    Removes the triggers installed by install_notify_triggers().
+    """
+    table = quote_ident(model._meta.db_table, connection.connection)
+    for op, name in _notify_trigger_names(model):
+        cur.execute('DROP TRIGGER IF EXISTS %s ON %s' % (name, table))
+        cur.execute('DROP FUNCTION IF EXISTS %s()' % name)
+
+
 def post_migrate_mpathnode(model):
     # Note: model *isn't* a subclass of MPathNode, because django migrations are Weird.
     # if not issubclass(model, MPathNode):
@@ -42,19 +366,16 @@ def post_migrate_mpathnode(model):
     except FieldDoesNotExist:
         return
 
-    names = {
-        "table": quote_ident(model._meta.db_table, connection.connection),
-        "check_constraint": quote_ident('%s__check_ltree' % model._meta.db_table, connection.connection),
-    }
-
     cur = connection.cursor()
     # Check that the ltree is always consistent with being a child of _parent
-    cur.execute('''
-        ALTER TABLE %(table)s ADD CONSTRAINT %(check_constraint)s CHECK (
-            (parent_id IS NOT NULL AND ltree ~ (parent_id::text || '.*{1}')::lquery)
-            OR (parent_id IS NULL AND ltree ~ '*{1}'::lquery)
-        )
-    ''' % names)
+    install_ltree_check(model, cur)
+
+    if has_count_fields(model):
+        install_count_triggers(model, cur)
+
+    notify_channel = getattr(settings, 'MPATHY_NOTIFY_CHANNEL', None)
+    if notify_channel:
+        install_notify_triggers(model, cur, notify_channel)
 
 
 def inject_post_migration_operations(plan=None, apps=global_apps, using=DEFAULT_DB_ALIAS, **kwargs):
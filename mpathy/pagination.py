@@ -0,0 +1,122 @@
+from collections.abc import Sequence
+
+from django.db import models
+from django.db.models.expressions import RawSQL
+
+from .fields import Level, LTree
+
+
+class RowAfter(models.Func):
+    """
+    `(a, b) > (x, y)`. Unlike the equivalent OR of comparisons, the planner can use
+    a row comparison as a range condition on a multicolumn index.
+    """
+
+    output_field = models.BooleanField()
+
+    def __init__(self, lhs, rhs):
+        super(RowAfter, self).__init__(*lhs, *rhs)
+
+    def as_sql(self, compiler, connection):
+        sqls = []
+        params = []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            sqls.append(sql)
+            params.extend(expression_params)
+        half = len(sqls) // 2
+        return "(%s) > (%s)" % (", ".join(sqls[:half]), ", ".join(sqls[half:])), params
+
+
+class KeysetPage(Sequence):
+    """
+    A page of nodes from a KeysetPaginator.
+
+    Behaves like django's Page, except that pages are identified by cursors rather
+    than page numbers. Pass `next_cursor` to KeysetPaginator.page() to get the
+    next page.
+    """
+
+    def __init__(self, object_list, next_cursor, paginator):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.paginator = paginator
+
+    def __repr__(self):
+        return "<KeysetPage of %d nodes>" % len(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next()
+
+
+class KeysetPaginator:
+    """
+    Paginates an MPathQuerySet in depth-first (ltree) order, or in breadth-first
+    (level, then ltree) order.
+
+    Unlike django's Paginator this doesn't use OFFSET, so later pages are just as fast
+    as the first: each page is an index range scan starting after the last ltree on
+    the previous page. The ltree of that node is the cursor for the next page.
+
+    Depth-first order uses the btree index created by the unique constraint on ltree.
+    For breadth-first order on large tables, add an index on (nlevel(ltree), ltree).
+    """
+
+    def __init__(self, queryset, per_page, breadth_first=False):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.breadth_first = breadth_first
+
+    def _ordered(self):
+        if self.breadth_first:
+            return self.queryset.order_by(Level("ltree"), "ltree")
+        return self.queryset.order_by("ltree")
+
+    def _after(self, qs, cursor):
+        cursor = LTree(cursor)
+        if self.breadth_first:
+            # ltree__level is nlevel(), which is one more than LTree.level()
+            level = cursor.level() + 1
+            return qs.filter(
+                RowAfter(
+                    (Level("ltree"), models.F("ltree")),
+                    (models.Value(level), RawSQL("%s::ltree", [cursor])),
+                )
+            )
+        return qs.filter(ltree__gt=cursor)
+
+    def page(self, cursor=None):
+        """
+        Returns the page of nodes after the given cursor, or the first page if the
+        cursor is None.
+        """
+        qs = self._ordered()
+        if cursor is not None:
+            qs = self._after(qs, cursor)
+
+        # Fetch one extra node to find out whether there's another page
+        object_list = list(qs[: self.per_page + 1])
+        next_cursor = None
+        if len(object_list) > self.per_page:
+            object_list = object_list[: self.per_page]
+            next_cursor = object_list[-1].ltree
+        return KeysetPage(object_list, next_cursor, self)
+
+    def __iter__(self):
+        """
+        Iterates over all the pages.
+        """
+        page = self.page()
+        yield page
+        while page.has_next():
+            page = self.page(page.next_cursor)
+            yield page
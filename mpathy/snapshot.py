@@ -0,0 +1,162 @@
+from array import array
+
+from .fields import LTree
+
+
+class TreeSnapshot:
+    """
+    A compact, read-only copy of a tree, built by MPathQuerySet.tree_snapshot().
+
+    Nodes are stored in ltree order (depth-first) in parallel arrays. For the node at
+    offset `i`:
+     * `pks[i]`, `paths[i]` and `labels[i]` are its fields
+     * `parents[i]` is the offset of its parent, or -1 if the parent isn't in the snapshot
+     * `sizes[i]` is the number of nodes in its subtree, including itself.
+       Since the nodes are in depth-first order, its descendants are at offsets
+       `i + 1` to `i + sizes[i] - 1`.
+
+    Individual nodes are accessed as lightweight SnapshotNode views, e.g.
+    `snapshot['a.b']` or `snapshot.roots()`.
+    """
+
+    __slots__ = ("pks", "paths", "labels", "parents", "sizes", "_offsets")
+
+    def __init__(self, rows):
+        """
+        `rows` is an iterable of (pk, ltree, label) tuples, in ltree order.
+        """
+        self.pks = []
+        self.paths = []
+        self.labels = []
+        self.parents = array("l")
+        self.sizes = array("l")
+        self._offsets = {}
+
+        # Offsets of the current branch, from the outermost node inwards.
+        stack = []
+        for offset, (pk, path, label) in enumerate(rows):
+            while stack and not path.startswith(self.paths[stack[-1]] + "."):
+                top = stack.pop()
+                self.sizes[top] = offset - top
+            if stack and self.paths[stack[-1]] == path.rsplit(".", 1)[0]:
+                self.parents.append(stack[-1])
+            else:
+                self.parents.append(-1)
+            self.sizes.append(1)
+            self.pks.append(pk)
+            self.paths.append(path)
+            self.labels.append(label)
+            self._offsets[path] = offset
+            stack.append(offset)
+
+        for top in stack:
+            self.sizes[top] = len(self.paths) - top
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        for offset in range(len(self.paths)):
+            yield SnapshotNode(self, offset)
+
+    def __getitem__(self, path):
+        return SnapshotNode(self, self._offsets[path])
+
+    def __contains__(self, path):
+        return path in self._offsets
+
+    def get(self, path, default=None):
+        offset = self._offsets.get(path)
+        if offset is None:
+            return default
+        return SnapshotNode(self, offset)
+
+    def roots(self):
+        """
+        Returns the nodes whose parents aren't in the snapshot.
+        """
+        return [
+            SnapshotNode(self, offset)
+            for offset, parent in enumerate(self.parents)
+            if parent == -1
+        ]
+
+
+class SnapshotNode:
+    """
+    A view of a single node in a TreeSnapshot.
+    """
+
+    __slots__ = ("snapshot", "offset")
+
+    def __init__(self, snapshot, offset):
+        self.snapshot = snapshot
+        self.offset = offset
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, SnapshotNode)
+            and self.snapshot is other.snapshot
+            and self.offset == other.offset
+        )
+
+    def __hash__(self):
+        return hash((id(self.snapshot), self.offset))
+
+    def __repr__(self):
+        return "<SnapshotNode: %s>" % self.ltree
+
+    @property
+    def pk(self):
+        return self.snapshot.pks[self.offset]
+
+    @property
+    def ltree(self):
+        return LTree(self.snapshot.paths[self.offset])
+
+    @property
+    def label(self):
+        return self.snapshot.labels[self.offset]
+
+    @property
+    def subtree_size(self):
+        """
+        The number of nodes in this node's subtree, including itself.
+        """
+        return self.snapshot.sizes[self.offset]
+
+    def get_parent(self):
+        parent = self.snapshot.parents[self.offset]
+        if parent == -1:
+            return None
+        return SnapshotNode(self.snapshot, parent)
+
+    def get_children(self):
+        snapshot = self.snapshot
+        children = []
+        offset = self.offset + 1
+        end = self.offset + snapshot.sizes[self.offset]
+        while offset < end:
+            if snapshot.parents[offset] == self.offset:
+                children.append(SnapshotNode(snapshot, offset))
+            # Skip over this node's subtree to get to its next sibling
+            offset += snapshot.sizes[offset]
+        return children
+
+    def get_descendants(self, include_self=False):
+        start = self.offset if include_self else self.offset + 1
+        end = self.offset + self.snapshot.sizes[self.offset]
+        return [SnapshotNode(self.snapshot, offset) for offset in range(start, end)]
+
+    def get_ancestors(self, include_self=False):
+        """
+        Returns this node's ancestors, root first.
+        Stops at the first ancestor which isn't in the snapshot.
+        """
+        ancestors = []
+        offset = self.offset if include_self else self.snapshot.parents[self.offset]
+        while offset != -1:
+            ancestors.append(SnapshotNode(self.snapshot, offset))
+            offset = self.snapshot.parents[offset]
+        ancestors.reverse()
+        return ancestors
@@ -2,11 +2,18 @@
 
 
 
-from django import template
+import hashlib
+import re
 
+from django import template
+from django.core.exceptions import EmptyResultSet, ImproperlyConfigured
+from django.db import router
+from django.template.context import make_context
 from django.utils.encoding import force_str
 from django.utils.translation import gettext as _
 
+from mpathy.cache import get_subtree_cache
+
 register = template.Library()
 
 
@@ -28,28 +35,204 @@ def tree_path(items, separator=' > '):
     return separator.join(force_str(i) for i in items)
 
 
-NOTSET = object()
+# When streaming, {% recurse %} renders as a marker, which is replaced by the rendered
+# children once the current level has been rendered.
+RECURSE_MARKER = "\x00mpathy-recurse:%d\x00"
+RECURSE_MARKER_RE = re.compile("\x00mpathy-recurse:(\\d+)\x00")
+
+
+def _freeze_forloop(forloop):
+    # {% for %} updates its forloop dict in place, so copy it (and its parentloops)
+    # to keep the values from when {% recurse %} was rendered.
+    forloop = dict(forloop)
+    if forloop.get('parentloop'):
+        forloop['parentloop'] = _freeze_forloop(forloop['parentloop'])
+    return forloop
+
+
+class RecurseState:
+    """
+    The state of one {% recursetree %} while it renders.
+    """
+
+    def __init__(self, tree_node, fragment_cache=None, streaming=False):
+        self.tree_node = tree_node
+        self.fragment_cache = fragment_cache
+        self.streaming = streaming
+        # Levels waiting to be rendered, when streaming
+        self.pending = {}
+        self.next_id = 0
+
+    def fragment_key(self, nodes):
+        if self.fragment_cache is None or not nodes:
+            return None
+        return self.fragment_cache.key(nodes)
+
+    def recurse(self, context, nodes):
+        key = self.fragment_key(nodes)
+        if key is not None:
+            output = self.fragment_cache.get(key)
+            if output is not None:
+                return output
+
+        if self.streaming:
+            # The level is rendered after the for loop has moved on, so keep a copy
+            # of the variables as they are now.
+            values = context.flatten()
+            if 'forloop' in values:
+                values['forloop'] = _freeze_forloop(values['forloop'])
+            level_id = self.next_id
+            self.next_id += 1
+            self.pending[level_id] = (values, nodes, key)
+            return RECURSE_MARKER % level_id
+
+        output = self.tree_node.render_level(context, nodes, self)
+        if key is not None:
+            self.fragment_cache.set(key, output)
+        return output
+
+
+class FragmentCache:
+    """
+    Stores the rendered children of each node for {% recursetree ... cache %}.
+    """
+
+    def __init__(self, subtree_cache, fragment_name, queryset, timeout, vary_on):
+        self.subtree_cache = subtree_cache
+        self.fragment_name = fragment_name
+        # Different querysets of the same model may have different children
+        self.query = "%s:%r" % (queryset.model._meta.label, queryset.query.sql_with_params())
+        self.timeout = timeout
+        self.vary_on = vary_on
+
+    def key(self, nodes):
+        """
+        Returns the key for a level of nodes, or None if it can't be cached.
+        """
+        node = nodes[0]
+        parent_path = node.ltree.parent()
+        if parent_path is None:
+            return None
+        # Versions are kept for the write database (see MPathManager.cached_subtree())
+        db = router.db_for_write(node.__class__, instance=node)
+        versions = self.subtree_cache.versions(db, node._meta.db_table, parent_path)
+        key = hashlib.blake2b(
+            "\n".join(
+                [self.fragment_name, self.query, db, parent_path]
+                + list(versions)
+                + self.vary_on
+            ).encode("utf-8"),
+            digest_size=16,
+        )
+        return "mpathy:recursetree:%s" % key.hexdigest()
+
+    def get(self, key):
+        return self.subtree_cache.cache.get(key)
+
+    def set(self, key, output):
+        self.subtree_cache.cache.set(key, output, self.timeout)
 
 
 class RecurseTreeNode(template.Node):
-    def __init__(self, nodelist, parent_queryset_var):
+    """
+    Renders a tree, rendering the nodelist once per level. {% recurse %} renders the
+    child level in place, with a single context push.
+
+    iter_render() yields the output in chunks instead, for streaming (see
+    stream_template()).
+    """
+
+    def __init__(self, nodelist, parent_queryset_var, fragment_name=None,
+                 cache_timeout=None, vary_on=()):
         self.nodelist = nodelist
         self.parent_queryset_var = template.Variable(parent_queryset_var)
+        self.fragment_name = fragment_name
+        self.cache_timeout = cache_timeout
+        self.vary_on = vary_on
+
+    def _fragment_cache(self, context, qs):
+        if self.fragment_name is None:
+            return None
+        subtree_cache = get_subtree_cache()
+        if subtree_cache is None:
+            raise ImproperlyConfigured(
+                "{% recursetree ... cache %} needs the MPATHY_SUBTREE_CACHE setting"
+            )
+        try:
+            qs.query.sql_with_params()
+        except EmptyResultSet:
+            # Nothing to render, so nothing to cache
+            return None
+        return FragmentCache(
+            subtree_cache,
+            self.fragment_name,
+            qs,
+            self.cache_timeout.resolve(context),
+            [force_str(var.resolve(context)) for var in self.vary_on],
+        )
 
-    def render(self, context, qs=NOTSET):
-        with context.push():
-            if qs is NOTSET:
-                # At the top level, turn the given queryset into a list
-                # of top-level nodes.
-                qs = self.parent_queryset_var.resolve(context)
-                root_nodes = qs.get_cached_trees()
-                context[self.parent_queryset_var.var] = root_nodes
-            else:
-                # At lower levels, we've been passed in a list of child nodes.
-                context[self.parent_queryset_var.var] = qs
-            context['_mpathy_recursetree_parent'] = self
+    def render_level(self, context, nodes, state):
+        with context.push({
+            self.parent_queryset_var.var: nodes,
+            '_mpathy_recursetree_state': state,
+        }):
             return self.nodelist.render(context)
 
+    def render(self, context):
+        qs = self.parent_queryset_var.resolve(context)
+        state = RecurseState(self, self._fragment_cache(context, qs))
+        return self.render_level(context, qs.get_cached_trees(), state)
+
+    def _iter_level(self, context, nodes, state):
+        first_id = state.next_id
+        output = self.render_level(context, nodes, state)
+        expected = list(range(first_id, state.next_id))
+
+        # Alternating chunks of output and marker ids
+        parts = RECURSE_MARKER_RE.split(output)
+        if [int(level_id) for level_id in parts[1::2]] != expected:
+            raise template.TemplateSyntaxError(
+                "{% recurse %} can't be streamed inside a tag or filter which changes "
+                "its output, such as {% filter %}"
+            )
+        for i, part in enumerate(parts):
+            if i % 2:
+                yield state.pending.pop(int(part))
+            elif part:
+                yield part
+
+    def iter_render(self, context):
+        qs = self.parent_queryset_var.resolve(context)
+        state = RecurseState(self, self._fragment_cache(context, qs), streaming=True)
+
+        # Iterators over the parts of each level being rendered
+        stack = [self._iter_level(context, qs.get_cached_trees(), state)]
+        # Output since the outermost uncached fragment started, and the
+        # (stack depth, key, start in `recorded`) of each uncached fragment.
+        recorded = []
+        captures = []
+        while stack:
+            part = next(stack[-1], None)
+            if part is None:
+                stack.pop()
+                if captures and captures[-1][0] == len(stack):
+                    depth, key, start = captures.pop()
+                    state.fragment_cache.set(key, "".join(recorded[start:]))
+                    if not captures:
+                        del recorded[:]
+                continue
+
+            if not isinstance(part, str):
+                values, nodes, key = part
+                if key is not None:
+                    captures.append((len(stack), key, len(recorded)))
+                stack.append(self._iter_level(context.new(values), nodes, state))
+                continue
+
+            if captures:
+                recorded.append(part)
+            yield part
+
 
 @register.tag
 def recursetree(parser, token):
@@ -73,17 +256,45 @@ def recursetree(parser, token):
                     {% endfor %}
                 {% endrecursetree %}
             </ul>
+
+    With `{% recursetree nodes cache TIMEOUT [VARY_ON ...] %}`, the rendered children
+    of each node are stored in the subtree cache (see MPathManager.cached_subtree())
+    for TIMEOUT seconds, and re-rendered only when something in that subtree (or on
+    its ancestor chain) changes. Like {% cache %}, any other variables the output
+    depends on must be given as VARY_ON arguments.
     """
     bits = token.split_contents()
-    if len(bits) != 2:
-        raise template.TemplateSyntaxError(_('%s tag takes one argument') % bits[0])
+    if len(bits) == 2:
+        node_kwargs = {}
+    elif len(bits) >= 4 and bits[2] == 'cache':
+        node_kwargs = {
+            'cache_timeout': parser.compile_filter(bits[3]),
+            'vary_on': [parser.compile_filter(bit) for bit in bits[4:]],
+        }
+    else:
+        raise template.TemplateSyntaxError(
+            _('%s tag takes one argument, optionally followed by cache TIMEOUT [VARY_ON ...]')
+            % bits[0]
+        )
 
     parent_queryset_var = bits[1]
 
+    tokens = list(parser.tokens)
     nodelist = parser.parse(['endrecursetree'])
     parser.delete_first_token()
 
-    return RecurseTreeNode(nodelist, parent_queryset_var)
+    if node_kwargs:
+        # Name the fragment after the tag and everything inside it, since string
+        # templates all have the same origin name.
+        remaining = {id(t) for t in parser.tokens}
+        source = hashlib.blake2b(digest_size=16)
+        for t in [token] + [t for t in tokens if id(t) not in remaining]:
+            source.update(("%s:%s\n" % (t.token_type, t.contents)).encode('utf-8'))
+        node_kwargs['fragment_name'] = '%s:%s:%s' % (
+            parser.origin.name, token.lineno, source.hexdigest()
+        )
+
+    return RecurseTreeNode(nodelist, parent_queryset_var, **node_kwargs)
 
 
 class RecurseNode(template.Node):
@@ -91,15 +302,13 @@ class RecurseNode(template.Node):
         self.child_queryset_var = template.Variable(child_queryset_var)
 
     def render(self, context):
-        if '_mpathy_recursetree_parent' not in context:
+        if '_mpathy_recursetree_state' not in context:
             raise template.TemplateSyntaxError(
                 'Invalid syntax: {% recurse %} must be inside {% recursetree %}'
             )
 
-        parent = context['_mpathy_recursetree_parent']
-        qs = self.child_queryset_var.resolve(context)
-        with context.push():
-            return parent.render(context, qs)
+        state = context['_mpathy_recursetree_state']
+        return state.recurse(context, self.child_queryset_var.resolve(context))
 
 
 @register.tag
@@ -109,3 +318,32 @@ def recurse(parser, token):
         raise template.TemplateSyntaxError(_('%s tag takes one argument') % bits[0])
 
     return RecurseNode(bits[1])
+
+
+def stream_template(template, context=None, request=None):
+    """
+    Renders a template in chunks, for use with StreamingHttpResponse, e.g.
+
+        return StreamingHttpResponse(
+            stream_template(get_template('sitemap.html'), {'nodes': qs}, request)
+        )
+
+    {% recursetree %} tags at the top level of the template yield their output as it
+    is rendered. Everything else (including a {% recursetree %} inside a block or
+    another tag) is rendered in one go.
+
+    While streaming, each level is rendered before its children, so the children's
+    output isn't passed through tags which wrap {% recurse %}, such as {% spaceless %}
+    or {% filter %}. If such a tag changes the {% recurse %} output itself,
+    TemplateSyntaxError is raised.
+    """
+    template = getattr(template, 'template', template)
+    context = make_context(context, request, autoescape=template.engine.autoescape)
+    with context.render_context.push_state(template):
+        with context.bind_template(template):
+            context.template_name = template.name
+            for node in template.nodelist:
+                if isinstance(node, RecurseTreeNode):
+                    yield from node.iter_render(context)
+                else:
+                    yield node.render_annotated(context)
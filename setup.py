@@ -19,7 +19,12 @@ setup(
     author="Craig de Stigter",
     author_email="craig.ds@gmail.com",
     url="http://github.com/craigds/django-mpathy",
-    packages=["mpathy"],
+    packages=[
+        "mpathy",
+        "mpathy.management",
+        "mpathy.management.commands",
+        "mpathy.templatetags",
+    ],
     install_requires=[
         "psycopg2>=2.7",
         "Django>=2.2",
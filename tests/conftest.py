@@ -2,6 +2,7 @@ from __future__ import print_function, unicode_literals
 import os
 
 import django
+import pytest
 
 
 def pytest_configure():
@@ -49,3 +50,62 @@ def pytest_configure():
         INSTALLED_APPS=('mpathy', 'tests',),
     )
     django.setup()
+
+
+# The tree created by the make_tree fixture
+TREE = [
+    {'label': 'a', 'children': [
+        {'label': 'aa', 'children': [{'label': 'aaa'}]},
+        {'label': 'ab'},
+    ]},
+    {'label': 'b', 'children': [{'label': 'bb'}]},
+    {'label': 'c'},
+]
+
+
+@pytest.fixture
+def make_tree():
+    """
+    Returns a function which creates this tree of nodes of the given model
+    (MyTree by default):
+
+        a
+            aa
+                aaa
+            ab
+        b
+            bb
+        c
+    """
+    from .models import MyTree
+
+    def make_tree(model=MyTree):
+        model.objects.bulk_create_tree(TREE)
+
+    return make_tree
+
+
+# (test name, line) pairs recorded with the benchmark_report fixture, shown at the
+# end of the run
+BENCHMARK_RESULTS = []
+
+
+@pytest.fixture
+def benchmark_report(request):
+    """
+    Returns a function which records a line for the benchmark results section of
+    the terminal summary, so that they're shown without `pytest -s`.
+    """
+    return lambda line: BENCHMARK_RESULTS.append((request.node.name, line))
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not BENCHMARK_RESULTS:
+        return
+    terminalreporter.section('benchmark results')
+    test_name = None
+    for name, line in BENCHMARK_RESULTS:
+        if name != test_name:
+            test_name = name
+            terminalreporter.write_line('%s:' % name)
+        terminalreporter.write_line('    %s' % line)
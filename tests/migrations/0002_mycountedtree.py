@@ -0,0 +1,56 @@
+from django.db import migrations, models
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+
+import mpathy.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MyCountedTree",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("ltree", mpathy.fields.LTreeField(unique=True)),
+                ("label", models.CharField(max_length=255)),
+                ("child_count", models.PositiveIntegerField(default=0, editable=False)),
+                ("descendant_count", models.PositiveIntegerField(default=0, editable=False)),
+                (
+                    "parent",
+                    models.ForeignKey(
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="children",
+                        to="tests.MyCountedTree",
+                        to_field="ltree",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name="mycountedtree",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["ltree"], name="tests_mycou_ltree_0337e0_gist"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mycountedtree",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["parent"], name="tests_mycou_parent__d7b41f_gist"
+            ),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import migrations, models
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+
+import mpathy.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0003_mytreeitem"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MyNamedTree",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("ltree", mpathy.fields.LTreeField(unique=True)),
+                ("label", models.CharField(max_length=255)),
+                ("name", models.CharField(default="", max_length=255)),
+                (
+                    "parent",
+                    models.ForeignKey(
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="children",
+                        to="tests.MyNamedTree",
+                        to_field="ltree",
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name="mynamedtree",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["ltree"], name="tests_mynam_ltree_dc6ea9_gist"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="mynamedtree",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["parent"], name="tests_mynam_parent__54d3ac_gist"
+            ),
+        ),
+    ]
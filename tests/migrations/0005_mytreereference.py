@@ -0,0 +1,41 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tests", "0004_mynamedtree"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MyTreeReference",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "protected",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="protected_references",
+                        to="tests.MyTree",
+                    ),
+                ),
+                (
+                    "restricted",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.RESTRICT,
+                        related_name="restricted_references",
+                        to="tests.MyTree",
+                    ),
+                ),
+            ],
+        ),
+    ]
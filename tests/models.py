@@ -1,6 +1,46 @@
-from mpathy.models import MPathNode
+from django.db import models
+
+from mpathy.models import CountedMPathNode, MPathNode
 
 
 class MyTree(MPathNode):
     def __str__(self):
         return self.ltree
+
+
+class MyCountedTree(CountedMPathNode):
+    def __str__(self):
+        return self.ltree
+
+
+class MyNamedTree(MPathNode):
+    """
+    A tree with a column of its own, which has a default.
+    """
+
+    name = models.CharField(max_length=255, default="")
+
+    def __str__(self):
+        return self.ltree
+
+
+class MyTreeItem(models.Model):
+    """
+    A model with an ordinary foreign key to a tree node.
+    """
+
+    node = models.ForeignKey(MyTree, related_name="items", on_delete=models.CASCADE)
+    name = models.CharField(max_length=255)
+
+
+class MyTreeReference(models.Model):
+    """
+    A model with foreign keys to tree nodes which prevent them being deleted.
+    """
+
+    protected = models.ForeignKey(
+        MyTree, null=True, related_name="protected_references", on_delete=models.PROTECT
+    )
+    restricted = models.ForeignKey(
+        MyTree, null=True, related_name="restricted_references", on_delete=models.RESTRICT
+    )
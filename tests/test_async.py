@@ -0,0 +1,60 @@
+from asgiref.sync import async_to_sync
+
+from .models import MyTree
+from .test_db_consistency import flush_constraints
+
+
+def get_nodes(*paths):
+    return [MyTree.objects.get(ltree=path) for path in paths]
+
+
+def test_aget_cached_trees(db, make_tree, django_assert_num_queries):
+    make_tree()
+    a, b, c = get_nodes('a', 'b', 'c')
+    with django_assert_num_queries(1):
+        roots = async_to_sync(MyTree.objects.order_by('ltree').aget_cached_trees)()
+    assert roots == [a, b, c]
+    assert async_to_sync(roots[0].aget_children)() == get_nodes('a.aa', 'a.ab')
+
+
+def test_atree_snapshot(db, make_tree):
+    make_tree()
+    snapshot = async_to_sync(MyTree.objects.atree_snapshot)()
+    assert [node.ltree for node in snapshot] == [
+        'a', 'a.aa', 'a.aa.aaa', 'a.ab', 'b', 'b.bb', 'c'
+    ]
+
+
+def test_node_async_reads(db, make_tree):
+    make_tree()
+    a, aa, aaa, ab = get_nodes('a', 'a.aa', 'a.aa.aaa', 'a.ab')
+    assert set(async_to_sync(a.aget_children)()) == {aa, ab}
+    assert set(async_to_sync(a.aget_descendants)()) == {aa, aaa, ab}
+    assert set(async_to_sync(a.aget_descendants)(max_depth=1)) == {aa, ab}
+    assert set(async_to_sync(aaa.aget_ancestors)(include_self=True)) == {a, aa, aaa}
+    assert async_to_sync(aa.aget_siblings)() == [ab]
+    assert async_to_sync(aaa.ais_leaf_node)() is True
+    assert async_to_sync(aa.ais_leaf_node)() is False
+
+
+def test_amove_subtree(db, make_tree):
+    make_tree()
+    aa, ab = get_nodes('a.aa', 'a.ab')
+    async_to_sync(MyTree.objects.amove_subtree)(aa, ab)
+    flush_constraints()
+    assert aa.ltree == 'a.ab.aa'
+    assert MyTree.objects.filter(ltree='a.ab.aa.aaa').exists()
+
+
+def test_arelabel_and_adelete_subtree(db, make_tree):
+    make_tree()
+    aa, = get_nodes('a.aa')
+    async_to_sync(MyTree.objects.arelabel)(aa, 'x')
+    flush_constraints()
+    assert MyTree.objects.filter(ltree='a.x.aaa').exists()
+
+    total, counts = async_to_sync(MyTree.objects.adelete_subtree)(aa)
+    assert total == 2
+    assert list(MyTree.objects.values_list('ltree', flat=True).order_by('ltree')) == [
+        'a', 'a.ab', 'b', 'b.bb', 'c'
+    ]
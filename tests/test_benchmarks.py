@@ -0,0 +1,257 @@
+"""
+Benchmarks for the queries and bulk operations.
+
+These are skipped unless MPATHY_BENCHMARK is set in the environment, e.g.:
+
+    MPATHY_BENCHMARK=1 pytest tests/test_benchmarks.py
+
+The results are shown in the terminal summary at the end of the run.
+"""
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from django.db import connection
+from django.template import Context, Template
+
+from mpathy.fields import LTreeInternTable
+from mpathy.indexes import mpath_indexes
+from mpathy.operations import LTREE_CHECK_FORMS, drop_ltree_check, install_ltree_check
+from mpathy.templatetags.mpathy import stream_template
+
+from .models import MyTree
+from .test_db_consistency import flush_constraints
+from .test_templatetags import RECURSETREE
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('MPATHY_BENCHMARK'), reason='MPATHY_BENCHMARK not set'
+)
+
+NUM_NODES = int(os.environ.get('MPATHY_BENCHMARK_NODES', 20000))
+
+
+def wide_tree_rows(num_nodes, fanout=20):
+    """
+    Returns (parent_path, label) rows for a tree with the given fanout, breadth-first.
+    """
+    rows = [(None, 'root')]
+    paths = ['root']
+    i = 0
+    while len(rows) < num_nodes:
+        parent = paths[i]
+        for j in range(fanout):
+            if len(rows) >= num_nodes:
+                break
+            rows.append((parent, 'n%d' % j))
+            paths.append('%s.n%d' % (parent, j))
+        i += 1
+    return rows
+
+
+@pytest.fixture
+def report(benchmark_report):
+    def report(name, count, elapsed):
+        benchmark_report(
+            '%s: %d nodes in %.2fs (%.0f nodes/s)' % (name, count, elapsed, count / elapsed)
+        )
+
+    return report
+
+
+def test_benchmark_save_per_node(db, report):
+    rows = wide_tree_rows(min(NUM_NODES, 2000))
+    start = time.perf_counter()
+    for parent_path, label in rows:
+        MyTree.objects.create(parent_id=parent_path, label=label)
+    flush_constraints()
+    report('save() per node', len(rows), time.perf_counter() - start)
+
+
+def test_benchmark_bulk_create_tree(db, report):
+    rows = wide_tree_rows(NUM_NODES)
+    start = time.perf_counter()
+    MyTree.objects.bulk_create_tree(rows)
+    flush_constraints()
+    report('bulk_create_tree()', len(rows), time.perf_counter() - start)
+
+
+def test_benchmark_relabel(db, report):
+    rows = wide_tree_rows(NUM_NODES)
+    MyTree.objects.bulk_create_tree(rows)
+    flush_constraints()
+    root = MyTree.objects.get(ltree='root')
+
+    start = time.perf_counter()
+    MyTree.objects.relabel(root, 'renamed')
+    flush_constraints()
+    report('relabel()', len(rows), time.perf_counter() - start)
+
+
+def deep_tree_rows(num_nodes, depth=50, fanout=4):
+    """
+    Returns (parent_path, label) rows for a tree with many branches hanging off the
+    root, each `depth` levels deep, where every branch node has `fanout` leaf children.
+    """
+    rows = [(None, 'root')]
+    while len(rows) < num_nodes:
+        branch = 'root'
+        label = 'b%d' % len(rows)
+        for level in range(depth):
+            rows.append((branch, label))
+            branch = '%s.%s' % (branch, label)
+            label = 's'
+            for j in range(fanout):
+                rows.append((branch, 'n%d' % j))
+    return rows
+
+
+@pytest.fixture
+def time_query(benchmark_report):
+    def time_query(name, qs, repeat=20):
+        start = time.perf_counter()
+        for i in range(repeat):
+            count = len(list(qs.values_list('pk', flat=True)))
+        elapsed = (time.perf_counter() - start) / repeat
+        benchmark_report('%s: %d rows in %.2fms' % (name, count, elapsed * 1000))
+        return count
+
+    return time_query
+
+
+def test_benchmark_depth_limited_descendants(db, time_query):
+    MyTree.objects.bulk_create_tree(deep_tree_rows(NUM_NODES))
+    flush_constraints()
+    root = MyTree.objects.get(ltree='root')
+
+    time_query('get_descendants()', root.get_descendants())
+    time_query(
+        'get_descendants() filtered on level',
+        root.get_descendants().filter(ltree__level__lte=root.ltree.level() + 4),
+    )
+    time_query('get_descendants(max_depth=3)', root.get_descendants(max_depth=3))
+
+
+INDEX_STRATEGIES = {
+    'gist': {},
+    'gist siglen=256': {'siglen': 256},
+    'gist + btree parent': {'parent': 'btree'},
+    'gist + hash parent': {'parent': 'hash'},
+}
+
+
+def use_index_strategy(**kwargs):
+    """
+    Replaces the indexes on MyTree with the ones from mpath_indexes(**kwargs).
+    """
+    with connection.cursor() as cursor:
+        # Everything except the primary key and the unique constraint on ltree
+        cursor.execute(
+            """
+            SELECT indexname FROM pg_indexes
+            WHERE tablename = %s AND indexdef NOT LIKE 'CREATE UNIQUE%%'
+            """,
+            [MyTree._meta.db_table],
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
+
+    with connection.schema_editor() as editor:
+        for i, index in enumerate(mpath_indexes(**kwargs)):
+            index.name = 'bench_%d' % i
+            editor.add_index(MyTree, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE %s' % connection.ops.quote_name(MyTree._meta.db_table))
+
+
+def benchmark_index_strategies(time_query, rows):
+    MyTree.objects.bulk_create_tree(rows)
+    flush_constraints()
+    # An internal node in the middle of the tree, with a non-trivial subtree
+    node = (
+        MyTree.objects.filter(ltree__level=3)
+        .with_child_count()
+        .filter(child_count__gt=0)
+        .order_by('ltree')
+    )
+    node = node[node.count() // 2]
+
+    for name, kwargs in INDEX_STRATEGIES.items():
+        use_index_strategy(**kwargs)
+
+        def time_method(method, qs):
+            return time_query('%s: %s' % (name, method), qs)
+
+        assert time_method('get_children()', node.get_children())
+        time_method('get_siblings()', node.get_siblings())
+        assert time_method('get_descendants()', node.get_descendants())
+        time_method('get_descendants(max_depth=2)', node.get_descendants(max_depth=2))
+        assert time_method('get_ancestors()', node.get_ancestors())
+
+
+def test_benchmark_index_strategies_wide(db, time_query):
+    benchmark_index_strategies(time_query, wide_tree_rows(NUM_NODES))
+
+
+def test_benchmark_index_strategies_deep(db, time_query):
+    benchmark_index_strategies(time_query, deep_tree_rows(NUM_NODES))
+
+
+def use_ltree_check(form):
+    with connection.cursor() as cursor:
+        drop_ltree_check(MyTree, cursor)
+        install_ltree_check(MyTree, cursor, form=form)
+
+
+@pytest.mark.parametrize('form', LTREE_CHECK_FORMS)
+def test_benchmark_ltree_check_forms(db, form, report):
+    use_ltree_check(form)
+    rows = wide_tree_rows(NUM_NODES)
+
+    start = time.perf_counter()
+    MyTree.objects.bulk_create_tree(rows)
+    flush_constraints()
+    report('%s check: bulk_create_tree()' % form, len(rows), time.perf_counter() - start)
+
+    # Move everything except the root under another root
+    other = MyTree.objects.create(label='other')
+    children = list(MyTree.objects.get(ltree='root').get_children())
+    start = time.perf_counter()
+    MyTree.objects.move_subtrees([(child, other) for child in children])
+    flush_constraints()
+    report('%s check: move_subtrees()' % form, len(rows) - 1, time.perf_counter() - start)
+
+
+def test_benchmark_recursetree(db, report):
+    rows = wide_tree_rows(NUM_NODES)
+    MyTree.objects.bulk_create_tree(rows)
+    flush_constraints()
+    t = Template(RECURSETREE)
+
+    start = time.perf_counter()
+    t.render(Context({'nodes': MyTree.objects.all()}))
+    report('{% recursetree %}', len(rows), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for chunk in stream_template(t, {'nodes': MyTree.objects.all()}):
+        pass
+    report('{% recursetree %} streamed', len(rows), time.perf_counter() - start)
+
+
+def test_benchmark_ltree_interning(db, benchmark_report):
+    MyTree.objects.bulk_create_tree(wide_tree_rows(NUM_NODES))
+    flush_constraints()
+    field = MyTree._meta.get_field('ltree')
+
+    try:
+        for name, intern_table in [('plain', None), ('interned', LTreeInternTable(NUM_NODES))]:
+            field._intern_table = intern_table
+            tracemalloc.start()
+            rows = list(MyTree.objects.values_list('ltree', 'parent_id'))
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            benchmark_report('%s paths: %d rows in %.1fMB' % (name, len(rows), size / 1e6))
+            del rows
+    finally:
+        field._intern_table = None
@@ -0,0 +1,54 @@
+import pytest
+
+from .models import MyTree
+from .test_db_consistency import flush_constraints
+
+
+def test_bulk_create_tree_nested(db, django_assert_num_queries):
+    with django_assert_num_queries(1):
+        created = MyTree.objects.bulk_create_tree([
+            {'label': 'a', 'children': [
+                {'label': 'b', 'children': [
+                    {'label': 'c'},
+                ]},
+                {'label': 'd'},
+            ]},
+            {'label': 'e'},
+        ])
+    flush_constraints()
+
+    assert [n.ltree for n in created] == ['a', 'e', 'a.b', 'a.d', 'a.b.c']
+    assert all(n.pk for n in created)
+    assert set(MyTree.objects.values_list('ltree', flat=True)) == {
+        'a', 'a.b', 'a.b.c', 'a.d', 'e'
+    }
+    assert MyTree.objects.get(ltree='a.b.c').parent_id == 'a.b'
+
+
+def test_bulk_create_tree_rows(db):
+    MyTree.objects.create(label='a')
+    MyTree.objects.bulk_create_tree([
+        ('a.b', 'c'),
+        ('a', 'b'),
+        (None, 'x'),
+    ])
+    flush_constraints()
+
+    assert set(MyTree.objects.values_list('ltree', flat=True)) == {
+        'a', 'a.b', 'a.b.c', 'x'
+    }
+
+
+def test_bulk_create_tree_batches(db, django_assert_num_queries):
+    rows = [(None, 'root')] + [('root', 'n%d' % i) for i in range(25)]
+    with django_assert_num_queries(3):
+        MyTree.objects.bulk_create_tree(rows, batch_size=10)
+    flush_constraints()
+    assert MyTree.objects.count() == 26
+
+
+def test_bulk_create_tree_requires_label(db):
+    with pytest.raises(ValueError):
+        MyTree.objects.bulk_create_tree([{'label': ''}])
+    with pytest.raises(ValueError):
+        MyTree.objects.bulk_create_tree([(None, None)])
@@ -0,0 +1,112 @@
+import pytest
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from mpathy import cache as mpathy_cache
+
+from .models import MyTree
+
+
+@pytest.fixture
+def subtree_cache(settings, transactional_db):
+    # transactional_db, so that on_commit() invalidation happens straight away
+    settings.MPATHY_SUBTREE_CACHE = 'default'
+    caches['default'].clear()
+    mpathy_cache._subtree_cache = None
+    yield
+    mpathy_cache._subtree_cache = None
+
+
+def test_cached_subtree_not_configured(db):
+    with pytest.raises(ImproperlyConfigured):
+        MyTree.objects.cached_subtree('a')
+
+
+def test_cached_subtree(subtree_cache, make_tree, django_assert_num_queries):
+    make_tree()
+    with django_assert_num_queries(2):
+        a = MyTree.objects.cached_subtree('a')
+    with django_assert_num_queries(0):
+        assert MyTree.objects.cached_subtree('a') is a
+        assert [n.ltree for n in a.get_children()] == ['a.aa', 'a.ab']
+        assert [n.ltree for n in a.get_children()[0].get_children()] == ['a.aa.aaa']
+
+
+def test_cached_subtree_max_depth(subtree_cache, make_tree, django_assert_num_queries):
+    make_tree()
+    a = MyTree.objects.cached_subtree('a', max_depth=1)
+    with django_assert_num_queries(0):
+        aa = a.get_children()[0]
+    with django_assert_num_queries(1):
+        assert [n.ltree for n in aa.get_children()] == ['a.aa.aaa']
+
+
+def test_cached_subtree_does_not_exist(subtree_cache):
+    with pytest.raises(MyTree.DoesNotExist):
+        MyTree.objects.cached_subtree('nope')
+
+
+def test_cached_subtree_shared_between_processes(
+    subtree_cache, make_tree, django_assert_num_queries
+):
+    make_tree()
+    MyTree.objects.cached_subtree('a')
+    # A new in-process LRU, as in another process
+    mpathy_cache._subtree_cache = None
+    with django_assert_num_queries(0):
+        a = MyTree.objects.cached_subtree('a')
+    assert len(a.get_children()) == 2
+
+
+def test_save_invalidates_ancestors_only(subtree_cache, make_tree, django_assert_num_queries):
+    make_tree()
+    for path in ('a', 'a.aa', 'a.ab', 'c'):
+        MyTree.objects.cached_subtree(path)
+
+    MyTree.objects.create(label='x', parent_id='a.aa.aaa')
+
+    with django_assert_num_queries(0):
+        MyTree.objects.cached_subtree('a.ab')
+        MyTree.objects.cached_subtree('c')
+    with django_assert_num_queries(2):
+        aa = MyTree.objects.cached_subtree('a.aa')
+    assert [n.ltree for n in aa.get_children()[0].get_children()] == ['a.aa.aaa.x']
+    with django_assert_num_queries(2):
+        MyTree.objects.cached_subtree('a')
+
+
+def test_move_invalidates_descendants(subtree_cache, make_tree):
+    make_tree()
+    aa = MyTree.objects.get(ltree='a.aa')
+    c = MyTree.objects.get(ltree='c')
+    MyTree.objects.cached_subtree('a.aa.aaa')
+    c_cached = MyTree.objects.cached_subtree('c')
+    assert c_cached.get_children() == []
+
+    MyTree.objects.move_subtree(aa, c)
+
+    with pytest.raises(MyTree.DoesNotExist):
+        MyTree.objects.cached_subtree('a.aa.aaa')
+    assert [n.ltree for n in MyTree.objects.cached_subtree('c').get_children()] == ['c.aa']
+
+
+def test_relabel_invalidates_descendants(subtree_cache, make_tree):
+    make_tree()
+    MyTree.objects.cached_subtree('a.ab')
+    MyTree.objects.relabel(MyTree.objects.get(ltree='a'), 'z')
+    with pytest.raises(MyTree.DoesNotExist):
+        MyTree.objects.cached_subtree('a.ab')
+    assert MyTree.objects.cached_subtree('z.ab').ltree == 'z.ab'
+
+
+def test_delete_invalidates(subtree_cache, make_tree):
+    make_tree()
+    a = MyTree.objects.cached_subtree('a')
+    assert len(a.get_children()) == 2
+
+    MyTree.objects.delete_subtree(MyTree.objects.get(ltree='a.aa'))
+    assert len(MyTree.objects.cached_subtree('a').get_children()) == 1
+
+    MyTree.objects.get(ltree='a.ab').delete()
+    assert MyTree.objects.cached_subtree('a').get_children() == []
@@ -0,0 +1,142 @@
+import json
+from io import StringIO
+
+import pytest
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from .models import MyCountedTree, MyNamedTree, MyTree
+
+
+def export(*args, **options):
+    out = StringIO()
+    call_command('mpathy_export', *args, stdout=out, **options)
+    return out.getvalue()
+
+
+def import_(tmp_path, content, *args, **options):
+    path = tmp_path / 'import'
+    path.write_text(content)
+    out = StringIO()
+    call_command('mpathy_import', *args, str(path), stdout=out, **options)
+    return out.getvalue()
+
+
+def paths(model=MyTree):
+    return [str(n.ltree) for n in model.objects.order_by('ltree')]
+
+
+TREE_PATHS = ['a', 'a.aa', 'a.aa.aaa', 'a.ab', 'b', 'b.bb', 'c']
+
+
+def test_export_csv(db, make_tree):
+    make_tree()
+    assert export('tests.MyTree').splitlines() == [
+        'ltree,label,parent_id',
+        'a,a,',
+        'a.aa,aa,a',
+        'a.aa.aaa,aaa,a.aa',
+        'a.ab,ab,a',
+        'b,b,',
+        'b.bb,bb,b',
+        'c,c,',
+    ]
+
+
+def test_export_jsonl_subtree(db, make_tree):
+    make_tree()
+    output = export('tests.MyTree', format='jsonl', subtree='a.aa', columns=['ltree'])
+    assert [json.loads(line) for line in output.splitlines()] == [
+        {'ltree': 'a.aa'},
+        {'ltree': 'a.aa.aaa'},
+    ]
+
+
+def test_export_to_file(db, tmp_path, make_tree):
+    make_tree()
+    path = tmp_path / 'export.csv'
+    export('tests.MyTree', output=str(path))
+    assert path.read_text() == export('tests.MyTree')
+
+
+def test_export_not_a_tree(db):
+    with pytest.raises(CommandError):
+        export('tests.MyTreeItem')
+    with pytest.raises(CommandError):
+        export('tests.MyTree', columns=['label'])
+
+
+@pytest.mark.parametrize('format', ['csv', 'jsonl'])
+def test_round_trip_replace(db, tmp_path, make_tree, format):
+    make_tree()
+    content = export('tests.MyTree', format=format)
+    MyTree.objects.all().delete()
+    MyTree.objects.create(label='x')
+
+    out = import_(tmp_path, content, 'tests.MyTree', format=format, mode='replace')
+    assert out.strip() == 'Deleted 1 nodes, imported 7 nodes'
+    assert paths() == TREE_PATHS
+
+
+def test_import_derives_labels_and_parents(db, tmp_path):
+    import_(tmp_path, 'ltree\ne.f\ne\n', 'tests.MyTree')
+    assert [(n.ltree, n.label, n.parent_id) for n in MyTree.objects.order_by('ltree')] == [
+        ('e', 'e', None),
+        ('e.f', 'f', 'e'),
+    ]
+
+
+def test_import_merge(db, tmp_path, make_tree):
+    make_tree()
+    out = import_(tmp_path, 'ltree\na.ab.x\nd\n', 'tests.MyTree')
+    assert out.strip() == 'Imported 2 nodes'
+    assert paths() == sorted(TREE_PATHS + ['a.ab.x', 'd'])
+
+
+def test_import_merge_keeps_missing_columns(db, tmp_path):
+    MyNamedTree.objects.create(label='a', name='Alpha')
+    import_(tmp_path, 'ltree\na\na.b\n', 'tests.MyNamedTree')
+    # 'name' isn't in the file: existing nodes keep theirs, new ones get the default
+    assert list(MyNamedTree.objects.order_by('ltree').values_list('ltree', 'name')) == [
+        ('a', 'Alpha'),
+        ('a.b', ''),
+    ]
+
+
+def test_import_counted(db, tmp_path, make_tree):
+    make_tree(MyCountedTree)
+    content = export('tests.MyCountedTree')
+    import_(tmp_path, content, 'tests.MyCountedTree', mode='replace')
+    a = MyCountedTree.objects.get(ltree='a')
+    assert (a.child_count, a.descendant_count) == (2, 3)
+
+
+def test_import_invalid(db, tmp_path, make_tree):
+    make_tree()
+    content = '\n'.join([
+        'ltree,label,parent_id',
+        'x,x,',
+        'x,x,',
+        'x.y,z,x',
+        'x.w,w,a',
+        'q.r,r,q',
+    ])
+    with pytest.raises(CommandError) as excinfo:
+        import_(tmp_path, content, 'tests.MyTree', mode='replace')
+    message = str(excinfo.value)
+    assert 'x: duplicate path' in message
+    assert 'x.y: label is inconsistent with the path' in message
+    assert 'x.w: parent_id is inconsistent with the path' in message
+    assert 'q.r: parent is missing' in message
+    # Nothing was changed
+    assert paths() == TREE_PATHS
+
+
+def test_import_missing_parent_in_replace_mode(db, tmp_path, make_tree):
+    make_tree()
+    # a.ab exists, so merging is fine but replacing isn't
+    with pytest.raises(CommandError, match='a.ab.x: parent is missing'):
+        import_(tmp_path, 'ltree\na.ab.x\n', 'tests.MyTree', mode='replace')
+    import_(tmp_path, 'ltree\na.ab.x\n', 'tests.MyTree')
+    assert MyTree.objects.filter(ltree='a.ab.x').exists()
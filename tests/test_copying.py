@@ -0,0 +1,85 @@
+import pytest
+
+from django.db import IntegrityError
+
+from .models import MyCountedTree, MyTree
+from .test_db_consistency import flush_constraints
+
+
+def test_copy_subtree(db, make_tree, django_assert_num_queries):
+    make_tree()
+    a = MyTree.objects.get(ltree='a')
+    b = MyTree.objects.get(ltree='b')
+
+    with django_assert_num_queries(2):
+        new_a = MyTree.objects.copy_subtree(a, b)
+    flush_constraints()
+
+    assert new_a.ltree == 'b.a'
+    assert new_a.parent_id == 'b'
+    assert new_a.pk != a.pk
+    assert set(MyTree.objects.values_list('ltree', 'parent_id', 'label')) == {
+        ('a', None, 'a'),
+        ('a.aa', 'a', 'aa'),
+        ('a.aa.aaa', 'a.aa', 'aaa'),
+        ('a.ab', 'a', 'ab'),
+        ('b', None, 'b'),
+        ('b.bb', 'b', 'bb'),
+        ('b.a', 'b', 'a'),
+        ('b.a.aa', 'b.a', 'aa'),
+        ('b.a.aa.aaa', 'b.a.aa', 'aaa'),
+        ('b.a.ab', 'b.a', 'ab'),
+        ('c', None, 'c'),
+    }
+
+
+def test_copy_subtree_to_root_with_label(db, make_tree):
+    make_tree()
+    aa = MyTree.objects.get(ltree='a.aa')
+
+    new_aa, mapping = MyTree.objects.copy_subtree(aa, None, label='x', return_mapping=True)
+    flush_constraints()
+
+    assert new_aa.ltree == 'x'
+    assert new_aa.label == 'x'
+    assert new_aa.parent_id is None
+    new_pks = dict(
+        MyTree.objects.filter(ltree__descendant_or_equal='x').values_list('ltree', 'pk')
+    )
+    assert set(new_pks) == {'x', 'x.aaa'}
+    old_pks = dict(
+        MyTree.objects.filter(ltree__descendant_or_equal='a.aa').values_list('ltree', 'pk')
+    )
+    assert mapping == {
+        old_pks['a.aa']: new_pks['x'],
+        old_pks['a.aa.aaa']: new_pks['x.aaa'],
+    }
+
+
+def test_copy_subtree_existing_path(db, make_tree):
+    make_tree()
+    a = MyTree.objects.get(ltree='a')
+    with pytest.raises(IntegrityError):
+        MyTree.objects.copy_subtree(a, None)
+
+
+def test_copy_subtree_counts(db, make_tree):
+    make_tree(MyCountedTree)
+    a = MyCountedTree.objects.get(ltree='a')
+    b = MyCountedTree.objects.get(ltree='b')
+
+    MyCountedTree.objects.copy_subtree(a, b)
+    flush_constraints()
+
+    counts = {
+        node.ltree: (node.child_count, node.descendant_count)
+        for node in MyCountedTree.objects.filter(ltree__descendant_or_equal='b')
+    }
+    assert counts == {
+        'b': (2, 5),
+        'b.bb': (0, 0),
+        'b.a': (2, 3),
+        'b.a.aa': (1, 1),
+        'b.a.aa.aaa': (0, 0),
+        'b.a.ab': (0, 0),
+    }
@@ -0,0 +1,124 @@
+from .models import MyCountedTree
+from .test_db_consistency import flush_constraints
+
+
+def counts():
+    return {
+        node.ltree: (node.child_count, node.descendant_count)
+        for node in MyCountedTree.objects.all()
+    }
+
+
+def test_counts_on_create(db):
+    a = MyCountedTree.objects.create(label='a')
+    aa = MyCountedTree.objects.create(label='aa', parent=a)
+    MyCountedTree.objects.create(label='aaa', parent=aa)
+    MyCountedTree.objects.create(label='ab', parent=a)
+    MyCountedTree.objects.create(label='b')
+
+    assert counts() == {
+        'a': (2, 3),
+        'a.aa': (1, 1),
+        'a.aa.aaa': (0, 0),
+        'a.ab': (0, 0),
+        'b': (0, 0),
+    }
+
+
+def test_counts_on_bulk_create(db):
+    MyCountedTree.objects.bulk_create_tree([
+        {'label': 'a', 'children': [
+            {'label': 'aa', 'children': [{'label': 'aaa'}]},
+            {'label': 'ab'},
+        ]},
+    ])
+    assert counts() == {
+        'a': (2, 3),
+        'a.aa': (1, 1),
+        'a.aa.aaa': (0, 0),
+        'a.ab': (0, 0),
+    }
+
+
+def test_counts_on_insert_children_first(db):
+    # The parent FK is deferred, so children can be inserted before their parents.
+    MyCountedTree.objects.create(label='aaa', parent_id='a.aa')
+    MyCountedTree.objects.create(label='aa', parent_id='a')
+    MyCountedTree.objects.create(label='a')
+    flush_constraints()
+
+    assert counts() == {
+        'a': (1, 2),
+        'a.aa': (1, 1),
+        'a.aa.aaa': (0, 0),
+    }
+
+
+def test_counts_on_delete(db):
+    a = MyCountedTree.objects.create(label='a')
+    aa = MyCountedTree.objects.create(label='aa', parent=a)
+    MyCountedTree.objects.create(label='aaa', parent=aa)
+    MyCountedTree.objects.create(label='ab', parent=a)
+
+    aa.delete()
+    assert counts() == {
+        'a': (1, 1),
+        'a.ab': (0, 0),
+    }
+
+
+def test_counts_on_move(db):
+    a = MyCountedTree.objects.create(label='a')
+    aa = MyCountedTree.objects.create(label='aa', parent=a)
+    MyCountedTree.objects.create(label='aaa', parent=aa)
+    b = MyCountedTree.objects.create(label='b')
+    bb = MyCountedTree.objects.create(label='bb', parent=b)
+    c = MyCountedTree.objects.create(label='c')
+
+    MyCountedTree.objects.move_subtree(aa, bb)
+    flush_constraints()
+    assert counts() == {
+        'a': (0, 0),
+        'b': (1, 3),
+        'b.bb': (1, 2),
+        'b.bb.aa': (1, 1),
+        'b.bb.aa.aaa': (0, 0),
+        'c': (0, 0),
+    }
+
+    MyCountedTree.objects.move_subtrees([(aa, a), (c, bb)])
+    flush_constraints()
+    assert counts() == {
+        'a': (1, 2),
+        'a.aa': (1, 1),
+        'a.aa.aaa': (0, 0),
+        'b': (1, 2),
+        'b.bb': (1, 1),
+        'b.bb.c': (0, 0),
+    }
+
+
+def test_save_doesnt_overwrite_counts(db):
+    a = MyCountedTree.objects.create(label='a')
+    MyCountedTree.objects.create(label='aa', parent=a)
+    assert a.child_count == 0
+
+    a.save()
+    a.refresh_from_db()
+    assert a.child_count == 1
+    assert a.descendant_count == 1
+
+
+def test_counted_annotations(db, django_assert_num_queries):
+    a = MyCountedTree.objects.create(label='a')
+    MyCountedTree.objects.create(label='aa', parent=a)
+
+    nodes = {
+        node.ltree: node
+        for node in MyCountedTree.objects.with_child_count().with_descendant_count().with_is_leaf()
+    }
+    with django_assert_num_queries(0):
+        assert nodes['a'].child_count == 1
+        assert not nodes['a'].is_leaf
+        assert nodes['a.aa'].is_leaf
+        assert nodes['a.aa'].is_leaf_node()
@@ -2,6 +2,8 @@ import pytest
 
 from django.db import connection, IntegrityError
 
+from mpathy.operations import LTREE_CHECK_FORMS, drop_ltree_check, install_ltree_check
+
 from .models import MyTree
 
 
@@ -74,3 +76,48 @@ def test_parent_is_descendant_errors(db):
     with pytest.raises(IntegrityError):
         child2.save()
         flush_constraints()
+
+
+@pytest.fixture(params=LTREE_CHECK_FORMS)
+def ltree_check(request, db):
+    """
+    Replaces the ltree check on MyTree with each form in turn.
+    """
+    cur = connection.cursor()
+    drop_ltree_check(MyTree, cur)
+    install_ltree_check(MyTree, cur, form=request.param)
+    return request.param
+
+
+def test_ltree_check_allows_consistent_writes(ltree_check):
+    root1 = MyTree.objects.create(label='root1')
+    child2 = MyTree.objects.create(label='child2', parent=root1)
+    MyTree.objects.create(label='desc3', parent=child2)
+    root4 = MyTree.objects.create(label='root4')
+    MyTree.objects.move_subtree(child2, root4)
+    flush_constraints()
+    assert set(MyTree.objects.values_list('ltree', flat=True)) == {
+        'root1', 'root4', 'root4.child2', 'root4.child2.desc3'
+    }
+
+
+def test_ltree_check_parent_is_remote_ancestor_errors(ltree_check):
+    root1 = MyTree.objects.create(label='root1')
+    child2 = MyTree.objects.create(label='child2', parent=root1)
+    desc3 = MyTree.objects.create(label='desc3', parent=child2)
+    with pytest.raises(IntegrityError):
+        MyTree.objects.filter(pk=desc3.pk).update(parent=root1)
+        flush_constraints()
+
+
+def test_ltree_check_root_with_parent_path_errors(ltree_check):
+    root1 = MyTree.objects.create(label='root1')
+    child2 = MyTree.objects.create(label='child2', parent=root1)
+    with pytest.raises(IntegrityError):
+        MyTree.objects.filter(pk=child2.pk).update(parent=None)
+        flush_constraints()
+
+
+def test_ltree_check_unknown_form():
+    with pytest.raises(ValueError):
+        install_ltree_check(MyTree, None, form='regex')
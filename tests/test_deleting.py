@@ -0,0 +1,104 @@
+import pytest
+
+from django.db.models import ProtectedError, RestrictedError
+from django.db.models.signals import post_delete, pre_delete
+
+from .models import MyTree, MyTreeItem, MyTreeReference
+from .test_db_consistency import flush_constraints
+
+
+def paths():
+    return set(MyTree.objects.values_list('ltree', flat=True))
+
+
+def test_delete_subtree(db, make_tree, django_assert_num_queries):
+    make_tree()
+    a = MyTree.objects.get(ltree='a')
+
+    with django_assert_num_queries(2):
+        result = MyTree.objects.delete_subtree(a, collect_related=False)
+    flush_constraints()
+
+    assert result == (4, {'tests.MyTree': 4})
+    assert a.pk is None
+    assert paths() == {'b', 'b.bb', 'c'}
+
+
+def test_delete_subtrees(db, make_tree):
+    make_tree()
+    result = MyTree.objects.filter(ltree__in=['a.aa', 'b', 'b.bb']).delete_subtrees()
+    flush_constraints()
+
+    assert result == (4, {'tests.MyTree': 4})
+    assert paths() == {'a', 'a.ab', 'c'}
+
+
+def test_delete_subtrees_empty(db, make_tree):
+    make_tree()
+    assert MyTree.objects.filter(ltree='x').delete_subtrees() == (0, {})
+    assert len(paths()) == 7
+
+
+def test_delete_subtrees_related(db, make_tree):
+    make_tree()
+    MyTreeItem.objects.create(node=MyTree.objects.get(ltree='a.aa.aaa'), name='deleted')
+    MyTreeItem.objects.create(node=MyTree.objects.get(ltree='b'), name='kept')
+
+    result = MyTree.objects.filter(ltree='a').delete_subtrees()
+    flush_constraints()
+
+    assert result == (5, {'tests.MyTree': 4, 'tests.MyTreeItem': 1})
+    assert list(MyTreeItem.objects.values_list('name', flat=True)) == ['kept']
+
+
+def test_delete_subtrees_protected(db, make_tree):
+    make_tree()
+    MyTreeReference.objects.create(protected=MyTree.objects.get(ltree='a.aa.aaa'))
+
+    with pytest.raises(ProtectedError):
+        MyTree.objects.filter(ltree='a').delete_subtrees()
+    assert len(paths()) == 7
+
+    # Subtrees without any references can still be deleted
+    assert MyTree.objects.filter(ltree='b').delete_subtrees() == (2, {'tests.MyTree': 2})
+    flush_constraints()
+
+
+def test_delete_subtrees_restricted(db, make_tree):
+    make_tree()
+    MyTreeReference.objects.create(restricted=MyTree.objects.get(ltree='a.ab'))
+
+    with pytest.raises(RestrictedError):
+        MyTree.objects.filter(ltree='a').delete_subtrees()
+    assert len(paths()) == 7
+
+    assert MyTree.objects.filter(ltree='b').delete_subtrees() == (2, {'tests.MyTree': 2})
+    flush_constraints()
+
+
+def test_delete_subtrees_signals(db, make_tree):
+    make_tree()
+    pre, post = [], []
+
+    def on_pre_delete(sender, instance, **kwargs):
+        pre.append(instance.ltree)
+
+    def on_post_delete(sender, instance, **kwargs):
+        post.append(instance.ltree)
+
+    pre_delete.connect(on_pre_delete, sender=MyTree)
+    post_delete.connect(on_post_delete, sender=MyTree)
+    try:
+        MyTree.objects.filter(ltree='b').delete_subtrees()
+        assert sorted(pre) == ['b', 'b.bb']
+        assert sorted(post) == ['b', 'b.bb']
+
+        pre.clear()
+        post.clear()
+        MyTree.objects.filter(ltree='c').delete_subtrees(send_signals=False)
+        assert pre == post == []
+    finally:
+        pre_delete.disconnect(on_pre_delete, sender=MyTree)
+        post_delete.disconnect(on_post_delete, sender=MyTree)
+
+    assert paths() == {'a', 'a.aa', 'a.aa.aaa', 'a.ab'}
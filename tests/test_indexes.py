@@ -0,0 +1,39 @@
+import pytest
+
+from django.contrib.postgres.indexes import GistIndex, HashIndex
+from django.db import connection, models
+
+from mpathy.indexes import LTreeGistIndex, mpath_indexes
+
+from .models import MyTree
+
+
+def test_mpath_indexes_default():
+    indexes = mpath_indexes()
+    assert [type(i) for i in indexes] == [GistIndex, GistIndex]
+    assert [i.fields for i in indexes] == [['ltree'], ['parent']]
+
+
+def test_mpath_indexes_types():
+    indexes = mpath_indexes(ltree=None, parent='hash')
+    assert [type(i) for i in indexes] == [HashIndex]
+
+    indexes = mpath_indexes(parent='btree', siglen=256)
+    assert [type(i) for i in indexes] == [LTreeGistIndex, models.Index]
+    assert indexes[0].siglen == 256
+
+    with pytest.raises(ValueError):
+        mpath_indexes(parent='brin')
+
+
+def test_ltree_gist_index_siglen(db):
+    index = LTreeGistIndex(fields=['ltree'], siglen=256)
+    index.set_name_with_model(MyTree)
+    path, args, kwargs = index.deconstruct()
+    assert kwargs['siglen'] == 256
+
+    with connection.schema_editor() as editor:
+        sql = str(index.create_sql(MyTree, editor))
+    assert 'USING gist' in sql
+    assert 'gist_ltree_ops(siglen=256)' in sql
+    assert not index.opclasses
@@ -0,0 +1,156 @@
+import threading
+
+from django.db import DatabaseError, connection, transaction
+
+from mpathy.locking import SubtreeLockTimeout, subtree_lock_key, subtree_lock_keys
+
+from .models import MyTree
+from .test_db_consistency import flush_constraints
+
+
+def test_subtree_lock_keys():
+    keys = subtree_lock_keys('t', ['a.b.c'])
+    assert keys == sorted([
+        (subtree_lock_key('t', 'a'), False),
+        (subtree_lock_key('t', 'a.b'), False),
+        (subtree_lock_key('t', 'a.b.c'), True),
+    ])
+    assert subtree_lock_key('t', 'a') != subtree_lock_key('u', 'a')
+
+
+def test_subtree_lock_keys_merges_modes():
+    keys = dict(subtree_lock_keys('t', ['a.b', 'a'], anchors=['a.b.c', 'd']))
+    assert keys == {
+        subtree_lock_key('t', 'a'): True,
+        subtree_lock_key('t', 'a.b'): True,
+        subtree_lock_key('t', 'a.b.c'): False,
+        subtree_lock_key('t', 'd'): False,
+    }
+
+
+def held_advisory_locks():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT classid::bigint << 32 | objid::bigint FROM pg_locks "
+            "WHERE locktype = 'advisory' AND pid = pg_backend_pid()"
+        )
+        return {key for (key,) in cursor.fetchall()}
+
+
+def test_lock_subtree_refreshes_moved_node(db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    c = MyTree.objects.create(label='c')
+    stale = MyTree.objects.get(pk=b.pk)
+    MyTree.objects.move_subtree(b, c)
+
+    with MyTree.objects.lock_subtree(stale):
+        assert stale.ltree == 'c.b'
+        assert stale.parent_id == 'c'
+        # The locks for the old path were released, rather than kept out of order
+        held = held_advisory_locks()
+        assert subtree_lock_key(MyTree._meta.db_table, 'c.b') in held
+        assert subtree_lock_key(MyTree._meta.db_table, 'a.b') not in held
+
+
+def test_move_subtree_with_lock(db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    MyTree.objects.create(label='x', parent=b)
+    c = MyTree.objects.create(label='c')
+    MyTree.objects.move_subtree(b, c, lock=True, lock_timeout=1)
+    flush_constraints()
+    assert b.ltree == 'c.b'
+    assert MyTree.objects.filter(ltree='c.b.x').exists()
+
+
+def test_move_subtrees_with_lock(db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    c = MyTree.objects.create(label='c')
+    d = MyTree.objects.create(label='d', parent=c)
+    MyTree.objects.move_subtrees([(b, c), (d, None)], lock=True)
+    flush_constraints()
+    assert set(MyTree.objects.values_list('ltree', flat=True)) == {'a', 'c', 'c.b', 'd'}
+
+
+def run_in_thread(func):
+    """
+    Runs func in another thread, and so with another database connection.
+    """
+    result = {}
+
+    def target():
+        try:
+            result['value'] = func()
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    return result['value']
+
+
+def try_lock_in_thread(node):
+    """
+    Tries to lock the node's subtree from another connection.
+    Returns True if it was locked, or False if it timed out.
+    """
+    def lock():
+        try:
+            with MyTree.objects.lock_subtree(node, timeout=0.1):
+                return True
+        except SubtreeLockTimeout:
+            return False
+
+    return run_in_thread(lock)
+
+
+def test_lock_subtree_conflicts(transactional_db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    c = MyTree.objects.create(label='c', parent=b)
+    d = MyTree.objects.create(label='d', parent=a)
+    e = MyTree.objects.create(label='e')
+
+    with transaction.atomic():
+        with MyTree.objects.lock_subtree(b):
+            # Subtrees containing b, or inside it
+            assert try_lock_in_thread(a) is False
+            assert try_lock_in_thread(b) is False
+            assert try_lock_in_thread(c) is False
+            # Disjoint subtrees
+            assert try_lock_in_thread(d) is True
+            assert try_lock_in_thread(e) is True
+
+    assert try_lock_in_thread(b) is True
+
+
+def test_lock_subtree_opens_transaction(transactional_db):
+    a = MyTree.objects.create(label='a')
+    with MyTree.objects.lock_subtree(a):
+        assert connection.in_atomic_block
+    assert not connection.in_atomic_block
+
+
+def test_lock_subtree_with_rows(transactional_db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    c = MyTree.objects.create(label='c')
+
+    def row_is_locked(node):
+        def select():
+            try:
+                with transaction.atomic():
+                    list(MyTree.objects.filter(pk=node.pk).select_for_update(nowait=True))
+            except DatabaseError:
+                return True
+            return False
+
+        return run_in_thread(select)
+
+    with MyTree.objects.lock_subtree(a, lock_rows=True):
+        assert row_is_locked(a)
+        assert row_is_locked(b)
+        assert not row_is_locked(c)
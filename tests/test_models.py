@@ -1,4 +1,10 @@
-from mpathy.fields import LTree
+import pickle
+
+import pytest
+
+from django.db.models.expressions import Col
+
+from mpathy.fields import LTree, LTreeArray, LTreeField, LTreeInternTable
 from .models import MyTree
 
 
@@ -93,3 +99,106 @@ def test_is_descendant_of(db):
     # we allow None as it's like an actual single root node.
     assert a.is_descendant_of(None)
     assert a.is_descendant_of(None, include_self=True)
+
+
+def test_get_descendants_depth_limited(db):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='a', parent=a)
+    aaa = MyTree.objects.create(label='a', parent=aa)
+    aaaa = MyTree.objects.create(label='a', parent=aaa)
+    ab = MyTree.objects.create(label='b', parent=a)
+    MyTree.objects.create(label='b')
+
+    assert set(a.get_descendants(max_depth=1)) == {aa, ab}
+    assert set(a.get_descendants(max_depth=2)) == {aa, ab, aaa}
+    assert set(a.get_descendants(max_depth=2, include_self=True)) == {a, aa, ab, aaa}
+    assert set(a.get_descendants(min_depth=2)) == {aaa, aaaa}
+    assert set(a.get_descendants(min_depth=2, max_depth=2)) == {aaa}
+    assert set(aaaa.get_descendants(max_depth=3)) == set()
+
+    with pytest.raises(ValueError):
+        a.get_descendants(min_depth=-1)
+    with pytest.raises(ValueError):
+        a.get_descendants(max_depth=-1, include_self=True)
+    with pytest.raises(ValueError):
+        a.get_descendants(min_depth=3, max_depth=2)
+
+
+def test_ltree_methods():
+    abc = LTree('a.b.c')
+    assert abc.labels() == ['a', 'b', 'c']
+    assert abc.level() == 2
+    assert abc.parent() == 'a.b'
+    assert abc.parent().level() == 1
+    assert abc.parent().parent().is_root()
+    assert abc.parent().parent().parent() is None
+    # Cached in slots, without an instance dict
+    assert not hasattr(abc, '__dict__')
+    assert abc.parent() is abc.parent()
+    # The cache isn't pickled
+    assert not hasattr(pickle.loads(pickle.dumps(abc)), '_parent')
+
+    assert LTree('a.b').is_ancestor_of(abc)
+    assert not LTree('a.b').is_ancestor_of(LTree('a.bc'))
+    assert not LTree('a.b').is_ancestor_of(LTree('a.b'))
+    assert LTree('a.b').is_ancestor_of(LTree('a.b'), include_self=True)
+    assert not abc.is_ancestor_of(LTree('a.b'))
+
+
+def test_ltree_array():
+    prefixes = LTreeArray(['a', 'a.b', 'c-d', 'x.y'])
+    # 'a.b' is redundant, since it's inside 'a'
+    assert len(prefixes) == 3
+
+    assert prefixes.contains_ancestor_of('a')
+    assert not prefixes.contains_ancestor_of('a', include_self=False)
+    assert prefixes.contains_ancestor_of('a.b', include_self=False)
+    assert prefixes.contains_ancestor_of('c-d.e')
+    assert not prefixes.contains_ancestor_of('c')
+    assert not prefixes.contains_ancestor_of('a-b')
+    assert not prefixes.contains_ancestor_of('x')
+
+    assert prefixes.filter_descendants(
+        ['x.y.z', 'ab', 'a.z', 'x.yz', 'b', 'c-d']
+    ) == ['x.y.z', 'a.z', 'c-d']
+
+
+def test_ltree_intern_table():
+    table = LTreeInternTable(maxsize=4)
+    abc = table.get('a.b.c')
+    assert isinstance(abc, LTree)
+    assert abc == 'a.b.c'
+    assert abc.level() == 2
+    assert abc.labels() == ['a', 'b', 'c']
+
+    abd = table.get('a.b.d')
+    # shared parents
+    assert abd.parent() is abc.parent()
+    assert abd.parent() is table.get('a.b')
+    assert abd.parent().parent() is table.get('a')
+    assert abc.parent().parent().parent() is None
+
+    # least recently used paths are evicted
+    assert len(table) == 4
+    table.get('x')
+    assert len(table) == 4
+    assert table.get('a.b.c') is not abc
+    assert table.get('a.b.c') == abc
+
+
+def test_ltree_field_interning():
+    field = LTreeField(intern_cache_size=100)
+    a = field.from_db_value('a.b', None, None)
+    b = field.from_db_value('a.b', None, None)
+    assert a is b
+
+    # Foreign keys to the field are interned, but not the field's own column
+    fk = MyTree._meta.get_field('parent')
+    assert field.from_db_value('a.b', Col('t', fk, field), None) is a
+    own = field.from_db_value('a.b', Col('t', field), None)
+    assert own == a and own is not a
+    assert field.deconstruct()[3] == {'intern_cache_size': 100}
+
+    field = LTreeField()
+    assert field.from_db_value('a.b', None, None) is not field.from_db_value('a.b', None, None)
+    assert 'intern_cache_size' not in field.deconstruct()[3]
@@ -93,3 +93,125 @@ def test_move_root_with_children_to_nonroot(db):
         # So we check that saving it with the old path correctly raises an error.
         c.save()
         flush_constraints()
+
+
+def test_move_subtrees(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    c = MyTree.objects.create(label='c', parent=b)
+    d = MyTree.objects.create(label='d')
+    e = MyTree.objects.create(label='e', parent=d)
+
+    with django_assert_num_queries(1):
+        MyTree.objects.move_subtrees([(b, d), (e, None)])
+    flush_constraints()
+
+    assert b.ltree == 'd.b'
+    assert b.parent == d
+    assert e.ltree == 'e'
+    assert e.parent is None
+    assert set(MyTree.objects.values_list('ltree', 'parent_id')) == {
+        ('a', None),
+        ('d', None),
+        ('d.b', 'd'),
+        ('d.b.c', 'd.b'),
+        ('e', None),
+    }
+    c.refresh_from_db()
+    assert c.ltree == 'd.b.c'
+
+
+def test_move_subtrees_into_moved_subtree(db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    x = MyTree.objects.create(label='x')
+    y = MyTree.objects.create(label='y')
+
+    # b moves under x, and y moves under b (at its new location)
+    MyTree.objects.move_subtrees([(b, x), (y, b)])
+    flush_constraints()
+
+    assert b.ltree == 'x.b'
+    assert y.ltree == 'x.b.y'
+    assert y.parent_id == 'x.b'
+    assert set(MyTree.objects.values_list('ltree', flat=True)) == {
+        'a', 'x', 'x.b', 'x.b.y'
+    }
+
+
+def test_move_subtrees_noop(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    with django_assert_num_queries(0):
+        MyTree.objects.move_subtrees([(b, a), (a, None)])
+
+
+def test_move_subtrees_to_own_descendant(db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    with pytest.raises(BadMove):
+        MyTree.objects.move_subtrees([(a, b)])
+
+
+def test_move_subtrees_cycle(db):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    b = MyTree.objects.create(label='b')
+    bb = MyTree.objects.create(label='bb', parent=b)
+    with pytest.raises(BadMove):
+        MyTree.objects.move_subtrees([(a, bb), (b, aa)])
+
+
+def test_move_subtrees_overlapping(db):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    x = MyTree.objects.create(label='x')
+    with pytest.raises(BadMove):
+        MyTree.objects.move_subtrees([(a, x), (b, x)])
+    with pytest.raises(BadMove):
+        MyTree.objects.move_subtrees([(b, x), (b, None)])
+
+
+def test_relabel(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    MyTree.objects.create(label='c', parent=b)
+    MyTree.objects.create(label='d')
+
+    with django_assert_num_queries(1):
+        MyTree.objects.relabel(b, 'x')
+    flush_constraints()
+
+    assert b.label == 'x'
+    assert b.ltree == 'a.x'
+    assert set(MyTree.objects.values_list('ltree', 'parent_id', 'label')) == {
+        ('a', None, 'a'),
+        ('a.x', 'a', 'x'),
+        ('a.x.c', 'a.x', 'c'),
+        ('d', None, 'd'),
+    }
+
+
+def test_relabel_root(db):
+    a = MyTree.objects.create(label='a')
+    MyTree.objects.create(label='b', parent=a)
+
+    MyTree.objects.relabel(a, 'z')
+    flush_constraints()
+
+    assert a.ltree == 'z'
+    assert set(MyTree.objects.values_list('ltree', 'parent_id')) == {
+        ('z', None),
+        ('z.b', 'z'),
+    }
+
+
+def test_relabel_invalid(db):
+    a = MyTree.objects.create(label='a')
+    MyTree.objects.create(label='b')
+    with pytest.raises(ValueError):
+        MyTree.objects.relabel(a, '')
+    with pytest.raises(ValueError):
+        MyTree.objects.relabel(a, 'x.y')
+    with pytest.raises(IntegrityError):
+        MyTree.objects.relabel(a, 'b')
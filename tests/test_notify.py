@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+from django.core.cache import caches
+from django.db import connection
+
+from mpathy import cache as mpathy_cache
+from mpathy.notify import SubtreeChangeListener
+from mpathy.operations import drop_notify_triggers, install_notify_triggers
+
+from .models import MyTree
+
+CHANNEL = 'mpathy_tests'
+
+
+@pytest.fixture
+def listener(transactional_db):
+    # transactional_db, since notifications are only sent on commit. The triggers
+    # aren't rolled back either, so remove them afterwards.
+    with connection.cursor() as cursor:
+        install_notify_triggers(MyTree, cursor, CHANNEL)
+    received = []
+    listener = SubtreeChangeListener(
+        channel=CHANNEL, handler=lambda table, paths: received.append((table, paths))
+    )
+    listener.connect()
+    listener.received = received
+    yield listener
+    listener.close()
+    with connection.cursor() as cursor:
+        drop_notify_triggers(MyTree, cursor)
+
+
+def drain(listener):
+    # Notifications arrive asynchronously, so wait until they stop
+    while listener.poll(timeout=0.5):
+        pass
+
+
+def received_paths(listener):
+    drain(listener)
+    paths = [
+        sorted(paths) if paths is not None else None
+        for table, paths in listener.received
+        if table == MyTree._meta.db_table
+    ]
+    del listener.received[:]
+    return paths
+
+
+def test_notify_insert(listener):
+    MyTree.objects.bulk_create_tree([
+        {'label': 'a', 'children': [{'label': 'b'}, {'label': 'c'}]},
+        {'label': 'd'},
+    ])
+    assert received_paths(listener) == [['a', 'd']]
+
+
+def test_notify_update_and_delete(listener):
+    a = MyTree.objects.create(label='a')
+    b = MyTree.objects.create(label='b', parent=a)
+    MyTree.objects.create(label='c', parent=b)
+    e = MyTree.objects.create(label='e')
+    received_paths(listener)
+
+    MyTree.objects.filter(ltree='a.b.c').update(label='c')
+    assert received_paths(listener) == [['a.b.c']]
+
+    MyTree.objects.move_subtree(b, e)
+    assert ['a.b', 'e.b'] in received_paths(listener)
+
+    MyTree.objects.filter(ltree__descendant_or_equal='e.b').delete()
+    assert ['e.b'] in received_paths(listener)
+
+
+def test_notify_update_nothing(listener):
+    MyTree.objects.filter(ltree='nope').update(label='x')
+    assert received_paths(listener) == []
+
+
+def test_listener_invalidates_subtree_cache(listener, settings, django_assert_num_queries):
+    settings.MPATHY_SUBTREE_CACHE = 'default'
+    caches['default'].clear()
+    mpathy_cache._subtree_cache = None
+    listener.handler = listener.invalidate
+
+    a = MyTree.objects.create(label='a')
+    MyTree.objects.create(label='b', parent=a)
+    MyTree.objects.create(label='c')
+    drain(listener)
+    MyTree.objects.cached_subtree('a')
+    MyTree.objects.cached_subtree('c')
+
+    # Not seen by mpathy's own invalidation
+    MyTree.objects.filter(ltree='a.b').update(label='b')
+    drain(listener)
+
+    with django_assert_num_queries(0):
+        MyTree.objects.cached_subtree('c')
+    with django_assert_num_queries(2):
+        MyTree.objects.cached_subtree('a')
+    mpathy_cache._subtree_cache = None
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def test_listener_reconnects(listener):
+    def handler(table, paths):
+        if paths == ['bad']:
+            raise ValueError(paths)
+        listener.received.append((table, paths))
+
+    listener.handler = handler
+    thread = threading.Thread(
+        target=listener.run, kwargs={'poll_interval': 0.1, 'retry_interval': 0.1}
+    )
+    thread.start()
+    try:
+        # Handler errors are logged, and the listener carries on
+        MyTree.objects.create(label='bad')
+        MyTree.objects.create(label='a')
+        wait_for(lambda: (MyTree._meta.db_table, ['a']) in listener.received)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_terminate_backend(%s)", [listener.connection.get_backend_pid()]
+            )
+        # After reconnecting, everything is assumed to have changed
+        wait_for(lambda: (MyTree._meta.db_table, None) in listener.received)
+
+        MyTree.objects.create(label='b')
+        wait_for(lambda: (MyTree._meta.db_table, ['b']) in listener.received)
+    finally:
+        listener.stop()
+        thread.join()
@@ -0,0 +1,51 @@
+from .models import MyTree
+
+
+def test_keyset_pagination_depth_first(db, make_tree, django_assert_num_queries):
+    make_tree()
+    paginator = MyTree.objects.keyset_paginator(per_page=3)
+
+    with django_assert_num_queries(1):
+        page = paginator.page()
+    assert [n.ltree for n in page] == ['a', 'a.aa', 'a.aa.aaa']
+    assert page.has_next()
+    assert page.next_cursor == 'a.aa.aaa'
+
+    page = paginator.page(page.next_cursor)
+    assert [n.ltree for n in page] == ['a.ab', 'b', 'b.bb']
+    assert page.has_next()
+
+    page = paginator.page(page.next_cursor)
+    assert [n.ltree for n in page] == ['c']
+    assert not page.has_next()
+    assert page.next_cursor is None
+
+
+def test_keyset_pagination_breadth_first(db, make_tree):
+    make_tree()
+    paginator = MyTree.objects.keyset_paginator(per_page=2, breadth_first=True)
+    pages = [[n.ltree for n in page] for page in paginator]
+    assert pages == [
+        ['a', 'b'],
+        ['c', 'a.aa'],
+        ['a.ab', 'b.bb'],
+        ['a.aa.aaa'],
+    ]
+
+
+def test_keyset_pagination_breadth_first_row_comparison(db):
+    # A single row comparison, so that an index on (nlevel(ltree), ltree) is used
+    # for a range scan rather than as a filter
+    paginator = MyTree.objects.keyset_paginator(per_page=2, breadth_first=True)
+    sql = str(paginator._after(paginator._ordered(), 'a.b').query)
+    assert '(nlevel("tests_mytree"."ltree"), "tests_mytree"."ltree") > (2, (a.b::ltree))' in sql
+    assert ' OR ' not in sql
+
+
+def test_keyset_pagination_subtree(db, make_tree):
+    make_tree()
+    a = MyTree.objects.get(ltree='a')
+    paginator = a.get_descendants().keyset_paginator(per_page=10)
+    page = paginator.page()
+    assert [n.ltree for n in page] == ['a.aa', 'a.aa.aaa', 'a.ab']
+    assert not page.has_next()
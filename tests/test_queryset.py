@@ -1,6 +1,7 @@
 # coding: utf-8
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import json
 
 from .models import MyTree
 
@@ -29,3 +30,313 @@ def test_get_cached_trees(db, django_assert_num_queries):
         assert cached[0].get_children()[0].get_children() == [aaa, aaz]
         assert cached[1].get_children() == [bb]
         assert cached[1].get_children()[0].get_children() == []
+
+
+def test_iter_cached_trees(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    aaa = MyTree.objects.create(label='aaa', parent=aa)
+    aaz = MyTree.objects.create(label='aaz', parent=aa)
+    b = MyTree.objects.create(label='b')
+    bb = MyTree.objects.create(label='bb', parent=b)
+
+    with django_assert_num_queries(1):
+        cached = list(MyTree.objects.iter_cached_trees(chunk_size=2))
+
+    with django_assert_num_queries(0):
+        assert cached == [a, b]
+        assert cached[0].get_children() == [aa]
+        assert cached[0].get_children()[0].get_children() == [aaa, aaz]
+        assert cached[1].get_children() == [bb]
+        assert cached[1].get_children()[0].get_children() == []
+
+
+def test_iter_cached_trees_is_lazy(db):
+    a = MyTree.objects.create(label='a')
+    MyTree.objects.create(label='aa', parent=a)
+    b = MyTree.objects.create(label='b')
+    MyTree.objects.create(label='bb', parent=b)
+
+    trees = MyTree.objects.iter_cached_trees(chunk_size=1)
+    assert next(trees) == a
+    assert next(trees) == b
+
+
+def test_iter_cached_trees_orphans(db):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    aaa = MyTree.objects.create(label='aaa', parent=aa)
+
+    cached = list(MyTree.objects.exclude(pk=aa.pk).iter_cached_trees())
+    assert cached == [aaa, a]
+    assert cached[1].get_children() == []
+
+
+def test_tree_snapshot(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    MyTree.objects.create(label='aaa', parent=aa)
+    MyTree.objects.create(label='aaz', parent=aa)
+    ab = MyTree.objects.create(label='ab', parent=a)
+    MyTree.objects.create(label='b')
+
+    with django_assert_num_queries(1):
+        snapshot = MyTree.objects.tree_snapshot()
+
+    with django_assert_num_queries(0):
+        assert len(snapshot) == 6
+        assert [n.ltree for n in snapshot.roots()] == ['a', 'b']
+
+        node = snapshot['a']
+        assert node.pk == a.pk
+        assert node.label == 'a'
+        assert node.subtree_size == 5
+        assert node.get_parent() is None
+        assert [n.ltree for n in node.get_children()] == ['a.aa', 'a.ab']
+        assert [n.ltree for n in node.get_descendants()] == [
+            'a.aa', 'a.aa.aaa', 'a.aa.aaz', 'a.ab'
+        ]
+
+        node = snapshot['a.aa.aaz']
+        assert node.subtree_size == 1
+        assert node.get_children() == []
+        assert node.get_parent() == snapshot['a.aa']
+        assert [n.ltree for n in node.get_ancestors()] == ['a', 'a.aa']
+        assert [n.ltree for n in node.get_ancestors(include_self=True)] == [
+            'a', 'a.aa', 'a.aa.aaz'
+        ]
+        assert snapshot['a.ab'].pk == ab.pk
+        assert 'a.zz' not in snapshot
+        assert snapshot.get('a.zz') is None
+
+
+def test_tree_snapshot_filtered(db):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    MyTree.objects.create(label='aaa', parent=aa)
+
+    snapshot = MyTree.objects.exclude(pk=aa.pk).tree_snapshot()
+    assert [n.ltree for n in snapshot.roots()] == ['a', 'a.aa.aaa']
+    assert snapshot['a'].get_children() == []
+    assert snapshot['a'].subtree_size == 2
+
+
+def test_prefetch_children(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    MyTree.objects.create(label='aaa', parent=aa)
+    ab = MyTree.objects.create(label='ab', parent=a)
+    b = MyTree.objects.create(label='b')
+
+    with django_assert_num_queries(2):
+        nodes = list(MyTree.objects.filter(ltree__level=1).order_by('ltree').prefetch_children())
+
+    with django_assert_num_queries(0):
+        assert nodes == [a, b]
+        assert sorted(nodes[0].get_children(), key=lambda n: n.ltree) == [aa, ab]
+        assert nodes[1].get_children() == []
+        # grandchildren weren't fetched
+        assert not hasattr(nodes[0].get_children()[0], '_cached_children')
+
+
+def test_prefetch_descendants(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    aaa = MyTree.objects.create(label='aaa', parent=aa)
+    aaaa = MyTree.objects.create(label='aaaa', parent=aaa)
+
+    with django_assert_num_queries(2):
+        nodes = list(MyTree.objects.filter(ltree='a').prefetch_descendants(max_depth=2))
+
+    with django_assert_num_queries(0):
+        assert nodes[0].get_children() == [aa]
+        assert nodes[0].get_children()[0].get_children() == [aaa]
+
+    with django_assert_num_queries(1):
+        assert list(nodes[0].get_children()[0].get_children()[0].get_children()) == [aaaa]
+
+    with django_assert_num_queries(2):
+        nodes = list(MyTree.objects.filter(ltree='a').prefetch_descendants())
+
+    with django_assert_num_queries(0):
+        assert nodes[0].get_children()[0].get_children()[0].get_children() == [aaaa]
+        assert aaaa in nodes[0].get_children()[0].get_children()[0].get_children()
+        assert nodes[0].get_children()[0].get_children()[0].get_children()[0].get_children() == []
+
+
+def test_prefetch_descendants_overlapping(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    MyTree.objects.create(label='aaa', parent=aa)
+
+    with django_assert_num_queries(2):
+        nodes = list(MyTree.objects.order_by('ltree').prefetch_children())
+
+    with django_assert_num_queries(0):
+        # the instances from the queryset are reused
+        assert nodes[0].get_children()[0] is nodes[1]
+        assert nodes[1].get_children()[0] is nodes[2]
+        assert nodes[2].get_children() == []
+
+
+def test_prefetch_ancestors(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    aaa = MyTree.objects.create(label='aaa', parent=aa)
+    aab = MyTree.objects.create(label='aab', parent=aa)
+    b = MyTree.objects.create(label='b')
+
+    with django_assert_num_queries(2):
+        nodes = list(
+            MyTree.objects.filter(ltree__level=3).order_by('ltree').prefetch_ancestors()
+        )
+
+    with django_assert_num_queries(0):
+        assert nodes == [aaa, aab]
+        assert nodes[0].get_ancestors() == [a, aa]
+        assert nodes[1].get_ancestors(include_self=True) == [a, aa, aab]
+        # shared ancestors are the same instances
+        assert nodes[0].get_ancestors()[1] is nodes[1].get_ancestors()[1]
+
+    with django_assert_num_queries(1):
+        nodes = list(MyTree.objects.filter(pk=b.pk).prefetch_ancestors())
+    assert nodes[0].get_ancestors() == []
+
+
+def test_array_lookups(db):
+    MyTree.objects.bulk_create_tree([
+        {'label': 'a', 'children': [{'label': 'aa'}, {'label': 'ab'}]},
+        {'label': 'b', 'children': [{'label': 'bb'}]},
+        {'label': 'c'},
+    ])
+
+    def paths(**kwargs):
+        return set(MyTree.objects.filter(**kwargs).values_list('ltree', flat=True))
+
+    assert paths(ltree__descendant_or_equal_any=['a', 'b.bb']) == {'a', 'a.aa', 'a.ab', 'b.bb'}
+    assert paths(ltree__ancestor_or_equal_any=['a.ab', 'b.bb']) == {'a', 'a.ab', 'b', 'b.bb'}
+    assert paths(ltree__lquery_any=['a.*{1}', 'c']) == {'a.aa', 'a.ab', 'c'}
+    assert paths(ltree__descendant_or_equal_any=[]) == set()
+
+
+def test_ltxtquery_lookup(db):
+    MyTree.objects.bulk_create_tree([
+        {'label': 'a', 'children': [{'label': 'aa'}, {'label': 'ba'}]},
+        {'label': 'b'},
+    ])
+
+    def paths(query):
+        return set(MyTree.objects.filter(ltree__ltxtquery=query).values_list('ltree', flat=True))
+
+    assert paths('ba') == {'a.ba'}
+    assert paths('a & !aa') == {'a', 'a.ba'}
+    assert paths('b*') == {'b', 'a.ba'}
+
+
+def test_subtree_annotations(db, django_assert_num_queries):
+    MyTree.objects.bulk_create_tree([
+        {'label': 'a', 'children': [
+            {'label': 'aa', 'children': [{'label': 'aaa'}, {'label': 'aab'}]},
+            {'label': 'ab'},
+        ]},
+        {'label': 'b'},
+    ])
+
+    with django_assert_num_queries(1):
+        nodes = {
+            node.ltree: node
+            for node in MyTree.objects.with_child_count().with_descendant_count().with_is_leaf()
+        }
+
+    with django_assert_num_queries(0):
+        assert {path: n.child_count for path, n in nodes.items()} == {
+            'a': 2, 'a.aa': 2, 'a.aa.aaa': 0, 'a.aa.aab': 0, 'a.ab': 0, 'b': 0,
+        }
+        assert {path: n.descendant_count for path, n in nodes.items()} == {
+            'a': 4, 'a.aa': 2, 'a.aa.aaa': 0, 'a.aa.aab': 0, 'a.ab': 0, 'b': 0,
+        }
+        assert {path for path, n in nodes.items() if n.is_leaf} == {
+            'a.aa.aaa', 'a.aa.aab', 'a.ab', 'b',
+        }
+        assert not nodes['a'].is_leaf_node()
+        assert nodes['b'].is_leaf_node()
+
+
+def test_is_leaf_node(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+
+    with django_assert_num_queries(1):
+        assert not a.is_leaf_node()
+    with django_assert_num_queries(1):
+        assert aa.is_leaf_node()
+
+    cached = MyTree.objects.get_cached_trees()
+    with django_assert_num_queries(0):
+        assert not cached[0].is_leaf_node()
+        assert cached[0].get_children()[0].is_leaf_node()
+
+
+def test_as_nested_json_empty(db):
+    assert MyTree.objects.as_nested_json() == b'[]'
+
+
+def test_as_nested_json(db, django_assert_num_queries):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    MyTree.objects.create(label='aaz', parent=aa)
+    MyTree.objects.create(label='aaa', parent=aa)
+    MyTree.objects.create(label='b')
+
+    with django_assert_num_queries(2):
+        doc = MyTree.objects.as_nested_json(fields=['label', 'ltree'])
+    assert isinstance(doc, bytes)
+    assert json.loads(doc) == [
+        {'label': 'a', 'ltree': 'a', 'children': [
+            {'label': 'aa', 'ltree': 'a.aa', 'children': [
+                {'label': 'aaa', 'ltree': 'a.aa.aaa', 'children': []},
+                {'label': 'aaz', 'ltree': 'a.aa.aaz', 'children': []},
+            ]},
+        ]},
+        {'label': 'b', 'ltree': 'b', 'children': []},
+    ]
+
+    # All concrete fields, keyed by attname
+    doc = json.loads(MyTree.objects.filter(ltree='b').as_nested_json())
+    b = MyTree.objects.get(ltree='b')
+    assert doc == [{'id': b.pk, 'ltree': 'b', 'label': 'b', 'parent_id': None, 'children': []}]
+
+
+def test_as_nested_json_outside_transaction(transactional_db, django_assert_num_queries):
+    MyTree.objects.create(label='a')
+
+    # Both queries see the same snapshot
+    with django_assert_num_queries(3) as captured:
+        doc = MyTree.objects.as_nested_json(fields=['label'])
+    assert captured[0]['sql'] == 'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ'
+    assert json.loads(doc) == [{'label': 'a', 'children': []}]
+
+
+def test_as_nested_json_subtree(db):
+    a = MyTree.objects.create(label='a')
+    aa = MyTree.objects.create(label='aa', parent=a)
+    MyTree.objects.create(label='aaa', parent=aa)
+    MyTree.objects.create(label='ab', parent=a)
+
+    # Nodes whose parents aren't in the queryset are at the top level
+    doc = aa.get_descendants(include_self=True).as_nested_json(fields=['pk', 'label'])
+    assert json.loads(doc) == [
+        {'pk': aa.pk, 'label': 'aa', 'children': [
+            {'pk': MyTree.objects.get(ltree='a.aa.aaa').pk, 'label': 'aaa', 'children': []},
+        ]},
+    ]
+    doc = MyTree.objects.exclude(ltree='a').as_nested_json(fields=['label'])
+    assert [node['label'] for node in json.loads(doc)] == ['aa', 'ab']
+
+
+def test_array_lookups_use_any(db):
+    # ltree <@ ltree[] can't use the GiST index, while ltree <@ ANY(ltree[]) can
+    sql = str(MyTree.objects.filter(ltree__descendant_or_equal_any=['a']).query)
+    assert '"tests_mytree"."ltree" <@ ANY(' in sql
+    sql = str(MyTree.objects.filter(ltree__ancestor_or_equal_any=['a']).query)
+    assert '"tests_mytree"."ltree" @> ANY(' in sql
@@ -2,7 +2,13 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 
-from django.template import Template, Context
+import pytest
+
+from django.core.cache import caches
+from django.template import Context, Template, TemplateSyntaxError
+
+from mpathy import cache as mpathy_cache
+from mpathy.templatetags.mpathy import stream_template
 
 from .models import MyTree
 
@@ -29,3 +35,128 @@ def test_render_recursetree(db):
         '    <li>a<ul>\n'
         '    <li>ab<ul></ul></li></ul></li>'
     )
+
+
+RECURSETREE = (
+    "{% load mpathy %}<ul>{% recursetree nodes %}"
+    "{% for node in nodes %}"
+    "<li>{{ node.label }}"
+    "{% if node.get_children %}<ul>{% recurse node.get_children %}</ul>{% endif %}"
+    "</li>"
+    "{% endfor %}"
+    "{% endrecursetree %}</ul>"
+)
+
+RENDERED_TREE = (
+    '<ul><li>a<ul><li>aa<ul><li>aaa</li></ul></li><li>ab</li></ul></li>'
+    '<li>b<ul><li>bb</li></ul></li><li>c</li></ul>'
+)
+
+
+def test_render_recursetree_deep(db, make_tree):
+    make_tree()
+    context = Context({'nodes': MyTree.objects.order_by('ltree')})
+    assert Template(RECURSETREE).render(context) == RENDERED_TREE
+
+
+FILTERED_RECURSETREE = (
+    "{% load mpathy %}{% recursetree nodes %}"
+    "{% for node in nodes %}"
+    "[{{ node.label }}{% filter upper %}{% recurse node.get_children %}{% endfilter %}]"
+    "{% endfor %}"
+    "{% endrecursetree %}"
+)
+
+
+def test_render_recursetree_filter(db, make_tree):
+    make_tree()
+    context = Context({'nodes': MyTree.objects.order_by('ltree')})
+    rendered = Template(FILTERED_RECURSETREE).render(context)
+    assert rendered == '[a[AA[AAA]][AB]][b[BB]][c]'
+
+
+def test_stream_template_filter(db, make_tree):
+    make_tree()
+    chunks = stream_template(
+        Template(FILTERED_RECURSETREE), {'nodes': MyTree.objects.order_by('ltree')}
+    )
+    with pytest.raises(TemplateSyntaxError):
+        list(chunks)
+
+
+def test_render_recursetree_parentloop(db, make_tree):
+    make_tree()
+    t = Template(
+        "{% load mpathy %}{% recursetree nodes %}"
+        "{% for node in nodes %}"
+        "{{ forloop.parentloop.counter }}-{{ node.label }} "
+        "{% recurse node.get_children %}"
+        "{% endfor %}"
+        "{% endrecursetree %}"
+    )
+    expected = '-a 1-aa 1-aaa 1-ab -b 2-bb -c '
+    assert t.render(Context({'nodes': MyTree.objects.order_by('ltree')})) == expected
+    assert ''.join(stream_template(t, {'nodes': MyTree.objects.order_by('ltree')})) == expected
+
+
+def test_recurse_outside_recursetree(db):
+    t = Template("{% load mpathy %}{% recurse nodes %}")
+    with pytest.raises(TemplateSyntaxError):
+        t.render(Context({'nodes': []}))
+
+
+def test_stream_template(db, make_tree):
+    make_tree()
+    t = Template(RECURSETREE)
+    chunks = list(stream_template(t, {'nodes': MyTree.objects.order_by('ltree')}))
+    assert len(chunks) > 3
+    assert ''.join(chunks) == t.render(Context({'nodes': MyTree.objects.order_by('ltree')}))
+
+
+def test_render_recursetree_fragment_cache(settings, transactional_db, make_tree):
+    settings.MPATHY_SUBTREE_CACHE = 'default'
+    caches['default'].clear()
+    mpathy_cache._subtree_cache = None
+
+    make_tree()
+    t = Template(RECURSETREE.replace('recursetree nodes', 'recursetree nodes cache 300'))
+
+    def render():
+        return t.render(Context({'nodes': MyTree.objects.order_by('ltree')}))
+
+    assert render() == RENDERED_TREE
+
+    # QuerySet.update() isn't seen by the cache, so the children of 'a' are still cached
+    MyTree.objects.filter(ltree='a.ab').update(label='zz')
+    assert '<li>ab</li>' in render()
+
+    # save() invalidates the subtrees it touches
+    MyTree.objects.create(label='ac', parent_id='a')
+    assert render() == (
+        '<ul><li>a<ul><li>aa<ul><li>aaa</li></ul></li><li>zz</li><li>ac</li></ul></li>'
+        '<li>b<ul><li>bb</li></ul></li><li>c</li></ul>'
+    )
+    mpathy_cache._subtree_cache = None
+
+
+def test_render_recursetree_fragment_cache_keys(settings, db, make_tree):
+    settings.MPATHY_SUBTREE_CACHE = 'default'
+    caches['default'].clear()
+    mpathy_cache._subtree_cache = None
+
+    make_tree()
+    cached = RECURSETREE.replace('recursetree nodes', 'recursetree nodes cache 300')
+    nodes = MyTree.objects.order_by('ltree')
+    assert Template(cached).render(Context({'nodes': nodes})) == RENDERED_TREE
+
+    # String templates all have the same origin, but are cached separately
+    other = Template(cached.replace('<li>', '<li class="x">'))
+    assert other.render(Context({'nodes': nodes})) == RENDERED_TREE.replace(
+        '<li>', '<li class="x">'
+    )
+
+    # So are different querysets
+    assert Template(cached).render(
+        Context({'nodes': nodes.exclude(ltree='a.ab')})
+    ) == RENDERED_TREE.replace('<li>ab</li>', '')
+    mpathy_cache._subtree_cache = None